@@ -1,22 +1,82 @@
+import asyncio
 import os
 import sys
+import threading
 from typing import List
 from datetime import datetime
 
 from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 # Add parent directory to path to import shared modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from shared.database import get_db
-from shared.models import Invoice, Project, Account, Vendor, Bill, JournalEntry, JournalEntryLine
-from shared.security import get_current_user_payload, TokenPayload
+from shared.database import engine, get_db, get_pool_stats
+from shared.models import Invoice, Project, Account, Vendor, Bill, JournalEntry, JournalEntryLine, MoneyAmount, UtcDateTime
+from shared.security import get_current_user_payload, TokenPayload, require_admin
+from shared.export import export_response
+from shared.rollups import record_rollup
+from shared.ledger import (
+    apply_balance_deltas, balance_deltas, post_journal_entries,
+    closed_through, lock_periods, write_balance_snapshot, close_due_period,
+    reconcile_ledger, latest_reconciliation,
+)
+
+# How often account balances are reconciled against the journal lines, in seconds (0 disables).
+LEDGER_RECONCILE_INTERVAL = int(os.getenv("LEDGER_RECONCILE_INTERVAL", "3600"))
+# When set, each month is closed automatically (balances snapshotted, earlier-dated entries
+# refused) once this many days have passed since it ended. Unset leaves closing to
+# POST /ledger/snapshots.
+LEDGER_AUTO_CLOSE_GRACE_DAYS = os.getenv("LEDGER_AUTO_CLOSE_GRACE_DAYS")
+# How often the automatic close checks whether a month is due, in seconds.
+LEDGER_AUTO_CLOSE_CHECK_INTERVAL = 3600
 
 # --- FastAPI App ---
 app = FastAPI()
 
+def report_drift(summary: dict | None):
+    if summary and summary["drift"]:
+        for line in summary["drift"]:
+            print(
+                f"Ledger drift on account {line['account_id']} ({line['account_name']}): "
+                f"balance {line['account_balance']} vs. journal lines {line['ledger_balance']}"
+            )
+
+async def reconcile_periodically():
+    while True:
+        try:
+            report_drift(await asyncio.to_thread(reconcile_ledger, engine))
+        except Exception as e:
+            # The tables may not exist yet if this service starts before auth creates them.
+            print(f"Ledger reconciliation failed: {e}")
+        await asyncio.sleep(LEDGER_RECONCILE_INTERVAL)
+
+async def close_periods_periodically():
+    while True:
+        try:
+            closed_at = await asyncio.to_thread(close_due_period, engine, int(LEDGER_AUTO_CLOSE_GRACE_DAYS))
+            if closed_at is not None:
+                print(f"Closed the books through {closed_at.isoformat()}.")
+        except Exception as e:
+            print(f"Automatic period close failed: {e}")
+        await asyncio.sleep(LEDGER_AUTO_CLOSE_CHECK_INTERVAL)
+
+@app.on_event("startup")
+async def start_reconciliation():
+    if LEDGER_RECONCILE_INTERVAL > 0:
+        app.state.reconciliation = asyncio.create_task(reconcile_periodically())
+    if LEDGER_AUTO_CLOSE_GRACE_DAYS is not None:
+        app.state.period_close = asyncio.create_task(close_periods_periodically())
+
+@app.on_event("shutdown")
+async def stop_reconciliation():
+    for name in ("reconciliation", "period_close"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+
 # --- CORS Middleware ---
 origins = [
     "http://localhost:3000",
@@ -28,11 +88,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Last-Write"],
 )
 
 # --- Pydantic Schemas ---
 class InvoiceCreate(BaseModel):
-    amount: float
+    amount: MoneyAmount
     project_id: int
     due_date: datetime | None = None
 
@@ -41,6 +102,8 @@ class InvoiceOut(BaseModel):
     amount: float
     status: str
     due_date: datetime | None = None
+    created_date: datetime | None = None
+    paid_date: datetime | None = None
     project_id: int
 
     class Config:
@@ -62,11 +125,45 @@ class AccountOut(BaseModel):
 class JournalEntryLineCreate(BaseModel):
     account_id: int
     type: str  # 'debit' or 'credit'
-    amount: float
+    amount: MoneyAmount
 
 class JournalEntryCreate(BaseModel):
     description: str
     lines: List[JournalEntryLineCreate]
+    date: UtcDateTime | None = None # Defaults to now; set it when importing past periods
+
+class JournalEntryBatch(BaseModel):
+    entries: List[JournalEntryCreate]
+    atomic: bool = True # Post nothing if any entry is invalid; otherwise post the valid ones
+
+class JournalEntryError(BaseModel):
+    index: int # Position of the entry in the submitted list
+    detail: str
+
+class JournalEntryBatchResult(BaseModel):
+    posted: int
+    entry_ids: List[int]
+    errors: List[JournalEntryError]
+
+class BalanceSnapshotCreate(BaseModel):
+    as_of: UtcDateTime # Entries dated before this moment are closed
+
+class BalanceSnapshotOut(BaseModel):
+    as_of: datetime
+    accounts: int
+
+class LedgerDriftLine(BaseModel):
+    account_id: int
+    account_name: str
+    ledger_balance: float # Sum of the account's journal lines
+    account_balance: float # The running Account.balance
+    drift: float
+
+class ReconciliationOut(BaseModel):
+    reconciled_at: datetime
+    last_line_id: int
+    accounts: int
+    drift: List[LedgerDriftLine]
 
 # --- A/P Schemas ---
 class VendorCreate(BaseModel):
@@ -82,23 +179,122 @@ class VendorOut(BaseModel):
 
 class BillCreate(BaseModel):
     vendor_id: int
-    amount: float
+    amount: MoneyAmount
     due_date: datetime | None = None
     expense_account_id: int # The account to debit (e.g., 'Office Supplies')
+    project_id: int | None = None # The project the cost is charged to, if any
 
 class BillOut(BaseModel):
     id: int
     vendor_id: int
     amount: float
     status: str
+    project_id: int | None = None
     class Config: orm_mode = True
 
 
+# --- Chart of Accounts Cache ---
+class ChartOfAccountsCache:
+    """
+    Account metadata (id, name, type, normal_balance) by id and by name, so postings
+    resolve system accounts like 'Accounts Receivable' without a query. Balances are
+    not cached: they change with every posting.
+
+    The whole chart is loaded in one query on first use. POST /accounts/ invalidates it.
+    A miss looks up only the missing ids or name and adds what it finds, which picks up
+    accounts created by other workers; an unknown id costs one primary-key lookup, never
+    a reload of the chart.
+    """
+
+    _columns = (Account.id, Account.name, Account.type, Account.normal_balance)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = None
+        self._by_name = None
+
+    def _load(self, db: Session):
+        rows = db.execute(select(*self._columns)).all()
+        with self._lock:
+            self._by_id = {row.id: row for row in rows}
+            self._by_name = {row.name: row for row in rows}
+
+    def _add_missing(self, db: Session, condition):
+        rows = db.execute(select(*self._columns).where(condition)).all()
+        with self._lock:
+            if self._by_id is not None:
+                self._by_id.update((row.id, row) for row in rows)
+                self._by_name.update((row.name, row) for row in rows)
+
+    def _maps(self, db: Session):
+        with self._lock:
+            by_id, by_name = self._by_id, self._by_name
+        if by_id is None:
+            self._load(db)
+            with self._lock:
+                by_id, by_name = self._by_id, self._by_name
+        return by_id, by_name
+
+    def by_ids(self, db: Session, account_ids) -> dict:
+        """Returns the known accounts among `account_ids`, keyed by id."""
+        by_id, _ = self._maps(db)
+        missing = set(account_ids) - by_id.keys()
+        if missing:
+            self._add_missing(db, Account.id.in_(missing))
+            by_id, _ = self._maps(db)
+        return {account_id: by_id[account_id] for account_id in account_ids if account_id in by_id}
+
+    def by_name(self, db: Session, name: str):
+        """Returns the account called `name`, or None."""
+        _, by_name = self._maps(db)
+        if name not in by_name:
+            self._add_missing(db, Account.name == name)
+            _, by_name = self._maps(db)
+        return by_name.get(name)
+
+    def invalidate(self):
+        with self._lock:
+            self._by_id = self._by_name = None
+
+
+chart_of_accounts = ChartOfAccountsCache()
+
+def normal_balances_for(db: Session, account_ids) -> dict:
+    return {account_id: account.normal_balance for account_id, account in chart_of_accounts.by_ids(db, account_ids).items()}
+
+
+# --- Posting Helpers ---
+def journal_entry_error(entry: JournalEntryCreate, normal_balances: dict, closed_at: datetime | None = None) -> str | None:
+    """
+    Returns why `entry` cannot be posted, or None if it can. `normal_balances` maps the
+    known account ids; `closed_at` is the end of the last closed period, if any.
+    """
+    if not entry.lines:
+        return "The journal entry has no lines."
+    if closed_at is not None and entry.date is not None and entry.date < closed_at:
+        return f"The books are closed before {closed_at.isoformat()}."
+    for line in entry.lines:
+        if line.type not in ("debit", "credit"):
+            return f"Invalid line type '{line.type}'. Use 'debit' or 'credit'."
+        if line.account_id not in normal_balances:
+            return f"Account with ID {line.account_id} not found."
+
+    total_debits = sum(line.amount for line in entry.lines if line.type == 'debit')
+    total_credits = sum(line.amount for line in entry.lines if line.type == 'credit')
+    if total_debits != total_credits:
+        return f"The journal entry is not balanced. Debits ({total_debits}) do not equal Credits ({total_credits})."
+    return None
+
+
 # --- API Endpoints ---
 @app.get("/")
 def read_root():
     return {"service": "Accounting Service", "status": "running"}
 
+@app.get("/pool-stats", dependencies=[Depends(require_admin)])
+def read_pool_stats():
+    return get_pool_stats()
+
 @app.post("/invoices/", response_model=InvoiceOut, status_code=status.HTTP_201_CREATED)
 def create_invoice(
     invoice: InvoiceCreate,
@@ -117,16 +313,17 @@ def create_invoice(
 
     # --- Auto-generate Journal Entry for the Invoice ---
     # Find 'Accounts Receivable' (Asset) and 'Sales Revenue' (Revenue) accounts
-    ar_acc = db.query(Account).filter(Account.name == "Accounts Receivable").first()
-    revenue_acc = db.query(Account).filter(Account.name == "Sales Revenue").first()
+    ar_acc = chart_of_accounts.by_name(db, "Accounts Receivable")
+    revenue_acc = chart_of_accounts.by_name(db, "Sales Revenue")
     if not ar_acc or not revenue_acc:
         raise HTTPException(status_code=500, detail="Core accounting accounts ('Accounts Receivable' or 'Sales Revenue') not found.")
 
     # Create the Invoice
-    new_invoice = Invoice(**invoice.dict(), status="pending")
+    new_invoice = Invoice(**invoice.dict(), status="pending", created_date=datetime.utcnow())
     db.add(new_invoice)
 
-    # Create the balanced Journal Entry
+    # Create the balanced Journal Entry, dated under the period-close lock
+    lock_periods(db)
     journal_entry = JournalEntry(description=f"Invoice for project {project.name}")
     db.add(journal_entry)
     db.flush()
@@ -136,9 +333,11 @@ def create_invoice(
     credit_line = JournalEntryLine(entry_id=journal_entry.id, account_id=revenue_acc.id, type='credit', amount=invoice.amount)
     db.add_all([debit_line, credit_line])
 
-    # Update account balances
-    ar_acc.balance += invoice.amount # Debit increases asset
-    revenue_acc.balance += invoice.amount # Credit increases revenue
+    # Update account balances in SQL, so concurrent postings to AR don't lose updates
+    normal_balances = {ar_acc.id: ar_acc.normal_balance, revenue_acc.id: revenue_acc.normal_balance}
+    apply_balance_deltas(db, balance_deltas([debit_line, credit_line], normal_balances))
+    # Last, like the balances, so the hot rollup row is locked only until the commit.
+    record_rollup(db, "invoiced", project.id, new_invoice.created_date, invoice.amount)
 
     db.commit()
     db.refresh(new_invoice)
@@ -177,6 +376,15 @@ def update_invoice_status(
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
 
+    # Keep the 'paid' time series in step with the status.
+    if status_update == "paid" and invoice.status != "paid":
+        invoice.paid_date = datetime.utcnow()
+        record_rollup(db, "paid", invoice.project_id, invoice.paid_date, invoice.amount)
+    elif status_update != "paid" and invoice.status == "paid":
+        if invoice.paid_date is not None:
+            record_rollup(db, "paid", invoice.project_id, invoice.paid_date, -invoice.amount, count=-1)
+        invoice.paid_date = None
+
     invoice.status = status_update
     db.commit()
     db.refresh(invoice)
@@ -196,6 +404,7 @@ def create_account(
     db_account = Account(**account.dict())
     db.add(db_account)
     db.commit()
+    chart_of_accounts.invalidate()
     db.refresh(db_account)
     return db_account
 
@@ -245,20 +454,30 @@ def create_bill(
         raise HTTPException(status_code=403, detail="Not authorized to create bills.")
 
     # Find the 'Accounts Payable' liability account
-    accounts_payable_acc = db.query(Account).filter(Account.name == "Accounts Payable").first()
+    accounts_payable_acc = chart_of_accounts.by_name(db, "Accounts Payable")
     if not accounts_payable_acc:
         raise HTTPException(status_code=500, detail="'Accounts Payable' account not found in Chart of Accounts.")
 
     # Find the expense account to debit
-    expense_acc = db.query(Account).filter(Account.id == bill.expense_account_id).first()
+    expense_acc = chart_of_accounts.by_ids(db, [bill.expense_account_id]).get(bill.expense_account_id)
     if not expense_acc:
         raise HTTPException(status_code=400, detail="Expense account not found.")
 
+    if bill.project_id is not None and db.get(Project, bill.project_id) is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+
     # Create the Bill
-    db_bill = Bill(vendor_id=bill.vendor_id, amount=bill.amount, due_date=bill.due_date)
+    db_bill = Bill(
+        vendor_id=bill.vendor_id,
+        amount=bill.amount,
+        due_date=bill.due_date,
+        project_id=bill.project_id,
+        created_date=datetime.utcnow(),
+    )
     db.add(db_bill)
 
-    # Create the balanced Journal Entry for this bill
+    # Create the balanced Journal Entry for this bill, dated under the period-close lock
+    lock_periods(db)
     journal_entry = JournalEntry(description=f"Bill from vendor {db_bill.vendor_id}")
     db.add(journal_entry)
     db.flush()
@@ -268,9 +487,14 @@ def create_bill(
     credit_line = JournalEntryLine(entry_id=journal_entry.id, account_id=accounts_payable_acc.id, type='credit', amount=bill.amount)
     db.add_all([debit_line, credit_line])
 
-    # Update account balances
-    expense_acc.balance += bill.amount # Debit increases expense
-    accounts_payable_acc.balance += bill.amount # Credit increases liability
+    # Update account balances in SQL, so concurrent postings to AP don't lose updates
+    normal_balances = {
+        expense_acc.id: expense_acc.normal_balance,
+        accounts_payable_acc.id: accounts_payable_acc.normal_balance,
+    }
+    apply_balance_deltas(db, balance_deltas([debit_line, credit_line], normal_balances))
+    # Last, like the balances: bills without a project all share one rollup row.
+    record_rollup(db, "billed", bill.project_id, db_bill.created_date, bill.amount)
 
     db.commit()
     db.refresh(db_bill)
@@ -287,39 +511,141 @@ def create_journal_entry(
     if token.role not in ["accountant", "admin"]:
         raise HTTPException(status_code=403, detail="Not authorized to create journal entries.")
 
-    # --- Validation: Entry must be balanced ---
-    total_debits = sum(line.amount for line in entry.lines if line.type == 'debit')
-    total_credits = sum(line.amount for line in entry.lines if line.type == 'credit')
-
-    if round(total_debits, 2) != round(total_credits, 2):
-        raise HTTPException(
-            status_code=400,
-            detail=f"The journal entry is not balanced. Debits ({total_debits}) do not equal Credits ({total_credits})."
-        )
+    # --- Validation: Entry must be balanced and reference existing accounts ---
+    account_ids = {line.account_id for line in entry.lines}
+    normal_balances = normal_balances_for(db, account_ids)
+    closed_at = closed_through(db)
+    error = journal_entry_error(entry, normal_balances, closed_at)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
 
     # --- Create Entry and Lines, Update Account Balances ---
-    db_entry = JournalEntry(description=entry.description)
+    db_entry = JournalEntry(description=entry.description, date=entry.date or datetime.utcnow())
     db.add(db_entry)
     db.flush() # Flush to get the entry ID
 
-    for line in entry.lines:
-        account = db.query(Account).filter(Account.id == line.account_id).first()
-        if not account:
-            raise HTTPException(status_code=400, detail=f"Account with ID {line.account_id} not found.")
-
-        db_line = JournalEntryLine(
-            entry_id=db_entry.id,
-            account_id=line.account_id,
-            type=line.type,
-            amount=line.amount
-        )
-        db.add(db_line)
+    db.add_all([
+        JournalEntryLine(entry_id=db_entry.id, account_id=line.account_id, type=line.type, amount=line.amount)
+        for line in entry.lines
+    ])
+    apply_balance_deltas(db, balance_deltas(entry.lines, normal_balances))
+
+    db.commit()
+    return {"message": "Journal entry created successfully", "entry_id": db_entry.id}
 
-        # Update account balance
-        if account.normal_balance == line.type:
-            account.balance += line.amount
+@app.post("/journal-entries/batch", response_model=JournalEntryBatchResult, status_code=status.HTTP_201_CREATED)
+def create_journal_entries_batch(
+    batch: JournalEntryBatch,
+    db: Session = Depends(get_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+):
+    """
+    Posts many journal entries in one transaction, for month-end imports.
+    All referenced accounts are loaded with one query, entries and lines are inserted
+    in bulk, and each account's balance is updated once with the sum of its deltas.
+    """
+    if token.role not in ["accountant", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to create journal entries.")
+
+    account_ids = {line.account_id for entry in batch.entries for line in entry.lines}
+    normal_balances = normal_balances_for(db, account_ids)
+    closed_at = closed_through(db)
+
+    errors, valid = [], []
+    for index, entry in enumerate(batch.entries):
+        detail = journal_entry_error(entry, normal_balances, closed_at)
+        if detail:
+            errors.append(JournalEntryError(index=index, detail=detail))
         else:
-            account.balance -= line.amount
+            valid.append(entry)
+    if errors and batch.atomic:
+        raise HTTPException(status_code=400, detail=[error.dict() for error in errors])
+    if not valid:
+        return JournalEntryBatchResult(posted=0, entry_ids=[], errors=errors)
 
+    entry_ids = post_journal_entries(db, valid, normal_balances)
     db.commit()
-    return {"message": "Journal entry created successfully", "entry_id": db_entry.id}
+    return JournalEntryBatchResult(posted=len(entry_ids), entry_ids=entry_ids, errors=errors)
+
+@app.post("/ledger/snapshots", response_model=BalanceSnapshotOut, status_code=status.HTTP_201_CREATED)
+def close_period(
+    snapshot: BalanceSnapshotCreate,
+    db: Session = Depends(get_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+):
+    """
+    Closes the books at `as_of` by snapshotting every account's balance. Point-in-time
+    reports then start from the snapshot, and entries can no longer be dated before it.
+    """
+    if token.role not in ["accountant", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to close periods.")
+    if snapshot.as_of > datetime.utcnow():
+        raise HTTPException(status_code=400, detail="A period cannot be closed in the future.")
+    closed_at = closed_through(db, exclusive=True)
+    if closed_at is not None and snapshot.as_of <= closed_at:
+        raise HTTPException(status_code=400, detail=f"The books are already closed through {closed_at.isoformat()}.")
+
+    accounts = write_balance_snapshot(db, snapshot.as_of)
+    db.commit()
+    return BalanceSnapshotOut(as_of=snapshot.as_of, accounts=accounts)
+
+@app.post("/ledger/reconcile", response_model=ReconciliationOut)
+def run_reconciliation(token: TokenPayload = Depends(get_current_user_payload)):
+    """Reconciles every account's balance against its journal lines now, instead of waiting for the next run."""
+    if token.role not in ["accountant", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to reconcile the ledger.")
+    summary = reconcile_ledger(engine)
+    if summary is None:
+        raise HTTPException(status_code=409, detail="A reconciliation is already running.")
+    report_drift(summary)
+    return summary
+
+@app.get("/ledger/reconciliation", response_model=ReconciliationOut)
+def get_latest_reconciliation(
+    db: Session = Depends(get_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+):
+    if token.role not in ["accountant", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to view ledger reconciliations.")
+    summary = latest_reconciliation(db)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="The ledger has not been reconciled yet.")
+    return summary
+
+@app.get("/journal-entries/export")
+def export_journal_lines(
+    token: TokenPayload = Depends(get_current_user_payload),
+    format: str = "ndjson",
+    cursor: int | None = None, # id of the last line already exported
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """
+    Streams the ledger, one row per journal line in posting order, as NDJSON or CSV
+    in constant memory. Resume an interrupted export by passing the last `line_id` as `cursor`.
+    """
+    if token.role not in ["accountant", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to export the ledger.")
+
+    stmt = (
+        select(
+            JournalEntryLine.id.label("line_id"),
+            JournalEntry.id.label("entry_id"),
+            JournalEntry.date,
+            JournalEntry.description,
+            Account.id.label("account_id"),
+            Account.name.label("account_name"),
+            JournalEntryLine.type,
+            JournalEntryLine.amount,
+        )
+        .join(JournalEntry, JournalEntryLine.entry_id == JournalEntry.id)
+        .join(Account, JournalEntryLine.account_id == Account.id)
+        .order_by(JournalEntryLine.id)
+    )
+    if cursor is not None:
+        stmt = stmt.where(JournalEntryLine.id > cursor)
+    if since is not None:
+        stmt = stmt.where(JournalEntry.date >= since)
+    if until is not None:
+        stmt = stmt.where(JournalEntry.date < until)
+    return export_response(stmt, format, lambda row: row._asdict(), filename="journal-lines")
@@ -1,22 +1,59 @@
+import asyncio
+import base64
 import os
 import sys
 from typing import List
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # Add parent directory to path to import shared modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from shared.database import get_db
-from shared.models import ActivityLog, User
-from shared.security import get_current_user_payload, TokenPayload
+from shared.database import engine, get_db, get_async_db, get_pool_stats
+from shared.models import ActivityLog, User, ACTIVITY_LOG_PARTITIONED
+from shared.partitions import maintain_activity_log_partitions
+from shared.export import export_response
+from shared.security import get_current_user_payload, get_current_user, CurrentUser, TokenPayload, require_admin
+
+# How often partitions are created ahead and the retention policy is applied, in seconds.
+ACTIVITY_LOG_MAINTENANCE_INTERVAL = int(os.getenv("ACTIVITY_LOG_MAINTENANCE_INTERVAL", "3600"))
+# How far in the past a non-admin caller may date an event. The activity logger sends an
+# event at most (retries + 1) flushes after it happened, each taking up to a flush interval
+# plus the HTTP timeout, so this covers its defaults (4 * (1s + 5s)) with room to spare.
+ACTIVITY_MAX_BACKDATE_SECONDS = float(os.getenv("ACTIVITY_MAX_BACKDATE_SECONDS", "60"))
+# Tolerated clock difference between the calling service and this one.
+ACTIVITY_CLOCK_SKEW_SECONDS = float(os.getenv("ACTIVITY_CLOCK_SKEW_SECONDS", "5"))
 
 # --- FastAPI App ---
 app = FastAPI()
 
+async def maintain_partitions_periodically():
+    while True:
+        try:
+            expired = await asyncio.to_thread(maintain_activity_log_partitions, engine)
+            if expired:
+                print(f"Expired activity log partitions: {', '.join(expired)}")
+        except Exception as e:
+            # The tables may not exist yet if this service starts before auth creates them.
+            print(f"Activity log partition maintenance failed: {e}")
+        await asyncio.sleep(ACTIVITY_LOG_MAINTENANCE_INTERVAL)
+
+@app.on_event("startup")
+async def start_partition_maintenance():
+    if ACTIVITY_LOG_PARTITIONED:
+        app.state.partition_maintenance = asyncio.create_task(maintain_partitions_periodically())
+
+@app.on_event("shutdown")
+async def stop_partition_maintenance():
+    task = getattr(app.state, "partition_maintenance", None)
+    if task is not None:
+        task.cancel()
+
 # --- CORS Middleware ---
 origins = ["http://localhost:3000"]
 app.add_middleware(
@@ -25,12 +62,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-DB-Last-Write"],
 )
 
 # --- Pydantic Schemas ---
 class ActivityLogCreate(BaseModel):
     action: str
     details: str | None = None
+    timestamp: datetime | None = None # When the action happened, if logged after the fact
+
+class ActivityLogBatchItem(ActivityLogCreate):
+    username: str | None = None # Only admins may attribute an event to another user
+
+class ActivityLogBatchResult(BaseModel):
+    inserted: int
 
 class ActivityLogOut(BaseModel):
     id: int
@@ -40,39 +85,166 @@ class ActivityLogOut(BaseModel):
     timestamp: datetime
     class Config: orm_mode = True
 
+# --- Keyset Cursors ---
+# A cursor is the (timestamp, id) of the last row a client has seen, encoded opaquely.
+def encode_cursor(log: ActivityLog) -> str:
+    raw = f"{log.timestamp.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        timestamp, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+def filter_activity_logs(
+    stmt,
+    user_id: int | None = None,
+    action: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: str | None = None,
+):
+    """Applies the shared filters, and the keyset position, to a newest-first ActivityLog query."""
+    if user_id is not None:
+        stmt = stmt.where(ActivityLog.user_id == user_id)
+    if action is not None:
+        stmt = stmt.where(ActivityLog.action == action)
+    if since is not None:
+        stmt = stmt.where(ActivityLog.timestamp >= since)
+    if until is not None:
+        stmt = stmt.where(ActivityLog.timestamp < until)
+    if cursor is not None:
+        stmt = stmt.where(tuple_(ActivityLog.timestamp, ActivityLog.id) < tuple_(*decode_cursor(cursor)))
+    return stmt.order_by(ActivityLog.timestamp.desc(), ActivityLog.id.desc())
+
+def event_timestamp(timestamp: datetime | None, current_user: CurrentUser, now: datetime) -> datetime:
+    """
+    The time to record for an event. Audit entries must not be dated in the future, and
+    only admins may backdate them further than ACTIVITY_MAX_BACKDATE_SECONDS; older
+    timestamps from anyone else are clamped to that window.
+    """
+    if timestamp is None:
+        return now
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    if timestamp > now + timedelta(seconds=ACTIVITY_CLOCK_SKEW_SECONDS):
+        raise HTTPException(status_code=422, detail="Activity timestamps cannot be in the future.")
+    if current_user.role == "admin":
+        return min(timestamp, now)
+    return min(max(timestamp, now - timedelta(seconds=ACTIVITY_MAX_BACKDATE_SECONDS)), now)
+
 # --- API Endpoints ---
 @app.get("/")
 def read_root():
     return {"service": "Activity Service", "status": "running"}
 
+@app.get("/pool-stats", dependencies=[Depends(require_admin)])
+def read_pool_stats():
+    return get_pool_stats()
+
 @app.post("/activities/", response_model=ActivityLogOut, status_code=status.HTTP_201_CREATED)
 def log_activity(
     activity: ActivityLogCreate,
     db: Session = Depends(get_db),
-    token: TokenPayload = Depends(get_current_user_payload), # The user who performed the action
+    current_user: CurrentUser = Depends(get_current_user), # The user who performed the action
 ):
-    user = db.query(User).filter(User.username == token.sub).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found.")
-
     new_log = ActivityLog(
-        user_id=user.id,
+        user_id=current_user.id,
         action=activity.action,
-        details=activity.details
+        details=activity.details,
+        timestamp=event_timestamp(activity.timestamp, current_user, datetime.utcnow()),
     )
     db.add(new_log)
     db.commit()
     db.refresh(new_log)
     return new_log
 
-@app.get("/activities/", response_model=List[ActivityLogOut])
-def get_activity_logs(
+@app.post("/activities/batch", response_model=ActivityLogBatchResult, status_code=status.HTTP_201_CREATED)
+def log_activities_batch(
+    events: List[ActivityLogBatchItem],
     db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    if current_user.role != "admin" and any(e.username not in (None, current_user.username) for e in events):
+        raise HTTPException(status_code=403, detail="Not authorized to log activity for other users.")
+    if not events:
+        return ActivityLogBatchResult(inserted=0)
+
+    # The caller's own id comes from the token; any other users in the batch are
+    # resolved with a single query.
+    user_ids = {current_user.username: current_user.id}
+    usernames = {e.username for e in events if e.username} - user_ids.keys()
+    if usernames:
+        user_ids.update(db.query(User.username, User.id).filter(User.username.in_(usernames)).all())
+        missing = usernames - user_ids.keys()
+        if missing:
+            raise HTTPException(status_code=404, detail=f"User(s) not found: {', '.join(sorted(missing))}.")
+
+    now = datetime.utcnow()
+    rows = [
+        {
+            "user_id": user_ids[e.username or current_user.username],
+            "action": e.action,
+            "details": e.details,
+            "timestamp": event_timestamp(e.timestamp, current_user, now),
+        }
+        for e in events
+    ]
+    # An executemany of a Core insert is sent as multi-row INSERT ... VALUES statements.
+    db.execute(insert(ActivityLog), rows)
+    db.commit()
+    return ActivityLogBatchResult(inserted=len(rows))
+
+@app.get("/activities/export")
+def export_activity_logs(
+    token: TokenPayload = Depends(get_current_user_payload),
+    format: str = "ndjson",
+    cursor: str | None = None,
+    user_id: int | None = None,
+    action: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """
+    Streams the full audit trail (newest first) as NDJSON or CSV in constant memory.
+    Every record carries its own `cursor`; pass the last one received to resume.
+    """
+    if token.role != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized to export activity logs.")
+
+    columns = select(ActivityLog.id, ActivityLog.user_id, ActivityLog.action, ActivityLog.details, ActivityLog.timestamp)
+    stmt = filter_activity_logs(columns, user_id, action, since, until, cursor)
+    return export_response(
+        stmt,
+        format,
+        lambda row: {**row._asdict(), "cursor": encode_cursor(row)},
+        filename="activity-logs",
+        extra_fields=("cursor",),
+    )
+
+@app.get("/activities/", response_model=List[ActivityLogOut])
+async def get_activity_logs(
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
     token: TokenPayload = Depends(get_current_user_payload),
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    user_id: int | None = None,
+    action: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
 ):
+    """
+    Newest-first activity, one page at a time. Pass the X-Next-Cursor header of a
+    response as `cursor` to fetch the following page.
+    """
     if token.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized to view activity logs.")
 
-    logs = db.query(ActivityLog).order_by(ActivityLog.timestamp.desc()).limit(limit).all()
+    stmt = filter_activity_logs(select(ActivityLog), user_id, action, since, until, cursor)
+    logs = (await db.execute(stmt.limit(limit))).scalars().all()
+    if len(logs) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(logs[-1])
     return logs
@@ -1,18 +1,29 @@
+import asyncio
+import hashlib
 import os
 import sys
+import time
 from typing import List
+from datetime import datetime
 
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 
 # Add parent directory to path to import shared modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from shared.database import get_db
-from shared.models import Project, Invoice, Quotation, Account
-from shared.security import get_current_user_payload, TokenPayload
+from shared.database import get_db, get_async_read_db, get_pool_stats
+from shared.models import Project, Invoice, Quotation, Account, AnalyticsRollup
+from shared.security import get_current_user_payload, TokenPayload, require_admin
+from shared.ledger import balances_as_of, balances_between
+from shared.rollups import ROLLUP_GRANULARITIES, ROLLUP_METRICS, period_start, rebuild_rollups
+
+# Dashboards poll the summary, so it is served from memory and recomputed at most once
+# per this many seconds, per worker. Totals may lag writes by up to this long.
+ANALYTICS_SUMMARY_TTL_SECONDS = float(os.getenv("ANALYTICS_SUMMARY_TTL_SECONDS", "30"))
 
 # --- FastAPI App ---
 app = FastAPI()
@@ -25,6 +36,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Last-Write"],
 )
 
 # --- Pydantic Schemas ---
@@ -53,79 +65,290 @@ class BalanceSheet(BaseModel):
     liability_lines: List[ReportLine]
     equity_lines: List[ReportLine]
 
+class TrialBalanceLine(BaseModel):
+    account_name: str
+    type: str
+    debit: float
+    credit: float
+
+class TrialBalance(BaseModel):
+    as_of: datetime
+    total_debits: float
+    total_credits: float
+    lines: List[TrialBalanceLine]
+
+class TimeSeriesPoint(BaseModel):
+    period_start: datetime
+    amount: float
+    count: int
+
+class TimeSeries(BaseModel):
+    metric: str
+    granularity: str
+    project_id: int | None = None # None when summed over all projects
+    points: List[TimeSeriesPoint]
+
+class RollupRebuildOut(BaseModel):
+    rollups: int
+
+# --- Report Queries ---
+# Each report is one statement: account rows carry their type's total through a window
+# function, so totals are computed in the database and no report re-sums in Python.
+# Reports for a date or period are computed from journal lines (see shared/ledger.py);
+# without one they read the running Account.balance.
+def account_balances(start: datetime | None = None, end: datetime | None = None):
+    if start is None and end is None:
+        return select(Account.name, Account.type, Account.normal_balance, Account.balance)
+    if start is None:
+        return balances_as_of(end).order_by(None)
+    return balances_between(start, end or datetime.utcnow()).order_by(None)
+
+async def report_accounts(db: AsyncSession, types: list, start: datetime | None = None, end: datetime | None = None) -> list:
+    """Accounts of the given types as rows of `name`, `type`, `balance` and `type_total`."""
+    stmt = account_balances(start, end)
+    accounts = stmt.where(stmt.selected_columns.type.in_(types)).subquery()
+    return (await db.execute(
+        select(
+            accounts.c.name,
+            accounts.c.type,
+            accounts.c.balance,
+            func.sum(accounts.c.balance).over(partition_by=accounts.c.type).label("type_total"),
+        ).order_by(accounts.c.type, accounts.c.name)
+    )).all()
+
+def type_totals(rows) -> dict:
+    return {row.type: row.type_total for row in rows}
+
+def report_lines(rows, type: str) -> List[ReportLine]:
+    return [ReportLine(account_name=row.name, balance=row.balance) for row in rows if row.type == type]
+
+# --- Summary Cache ---
+class SummaryCache:
+    """
+    The last computed summary with its ETag. When it expires, one request recomputes it
+    while concurrent requests wait for that result instead of querying too.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = asyncio.Lock()
+        self.summary = None
+        self.etag = None
+        self.expires_at = 0.0
+
+    async def get(self, compute):
+        if time.monotonic() >= self.expires_at:
+            async with self._lock:
+                if time.monotonic() >= self.expires_at:
+                    summary = await compute()
+                    body = summary.json().encode()
+                    self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+                    self.summary = summary
+                    self.expires_at = time.monotonic() + self.ttl
+        return self.summary, self.etag
+
+
+summary_cache = SummaryCache(ANALYTICS_SUMMARY_TTL_SECONDS)
+
+async def compute_analytics_summary(db: AsyncSession) -> AnalyticsSummary:
+    # One round-trip: each table is aggregated once in a scalar subquery, with
+    # conditional sums instead of separate filtered queries.
+    projects = select(func.count(Project.id), func.coalesce(func.sum(Project.budget), 0)).subquery()
+    invoice_paid = select(
+        func.coalesce(func.sum(case((Invoice.status == 'paid', Invoice.amount))), 0)
+    ).scalar_subquery()
+    quotes_accepted = select(
+        func.coalesce(func.sum(case((Quotation.status == 'accepted', Quotation.total_amount))), 0)
+    ).scalar_subquery()
+    row = (await db.execute(select(*projects.c, invoice_paid, quotes_accepted))).one()
+
+    return AnalyticsSummary(
+        total_projects=row[0],
+        total_project_budget=row[1],
+        total_invoice_paid=row[2],
+        total_quotes_accepted=row[3],
+    )
+
 # --- API Endpoints ---
 @app.get("/")
 def read_root():
     return {"service": "Analytics Service", "status": "running"}
 
+@app.get("/pool-stats", dependencies=[Depends(require_admin)])
+def read_pool_stats():
+    return get_pool_stats()
+
 @app.get("/analytics/summary", response_model=AnalyticsSummary)
-def get_analytics_summary(
-    db: Session = Depends(get_db),
+async def get_analytics_summary(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
     token: TokenPayload = Depends(get_current_user_payload),
 ):
     # This endpoint could be restricted by role, e.g., admin or sales
 
-    total_projects = db.query(func.count(Project.id)).scalar() or 0
-    total_project_budget = db.query(func.sum(Project.budget)).scalar() or 0.0
-
-    total_invoice_paid = db.query(func.sum(Invoice.amount)).filter(Invoice.status == 'paid').scalar() or 0.0
-
-    total_quotes_accepted = db.query(func.sum(Quotation.total_amount)).filter(Quotation.status == 'accepted').scalar() or 0.0
-
-    return AnalyticsSummary(
-        total_projects=total_projects,
-        total_project_budget=total_project_budget,
-        total_invoice_paid=total_invoice_paid,
-        total_quotes_accepted=total_quotes_accepted,
-    )
+    # The session only connects if the cached summary has expired.
+    summary, etag = await summary_cache.get(lambda: compute_analytics_summary(db))
+    max_age = max(0, int(summary_cache.expires_at - time.monotonic()))
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return summary
 
 @app.get("/reports/profit-and-loss", response_model=ProfitAndLoss)
-def get_profit_and_loss(
-    db: Session = Depends(get_db),
+async def get_profit_and_loss(
+    db: AsyncSession = Depends(get_async_read_db),
     token: TokenPayload = Depends(get_current_user_payload),
+    start: datetime | None = None,
+    end: datetime | None = None,
 ):
+    """
+    Revenue and expense to date, or over [start, end) when either bound is given
+    (an open start means since the beginning, an open end means until now).
+    """
     if token.role not in ["accountant", "admin"]:
         raise HTTPException(status_code=403, detail="Not authorized to view financial reports.")
 
-    revenue_accounts = db.query(Account).filter(Account.type == 'Revenue').all()
-    expense_accounts = db.query(Account).filter(Account.type == 'Expense').all()
-
-    total_revenue = sum(acc.balance for acc in revenue_accounts)
-    total_expense = sum(acc.balance for acc in expense_accounts)
-    net_income = total_revenue - total_expense
+    accounts = await report_accounts(db, ['Revenue', 'Expense'], start, end)
+    totals = type_totals(accounts)
+    total_revenue = totals.get('Revenue', 0)
+    total_expense = totals.get('Expense', 0)
 
     return ProfitAndLoss(
         total_revenue=total_revenue,
         total_expense=total_expense,
-        net_income=net_income,
-        revenue_lines=[ReportLine(account_name=acc.name, balance=acc.balance) for acc in revenue_accounts],
-        expense_lines=[ReportLine(account_name=acc.name, balance=acc.balance) for acc in expense_accounts],
+        net_income=total_revenue - total_expense,
+        revenue_lines=report_lines(accounts, 'Revenue'),
+        expense_lines=report_lines(accounts, 'Expense'),
     )
 
 @app.get("/reports/balance-sheet", response_model=BalanceSheet)
-def get_balance_sheet(
-    db: Session = Depends(get_db),
+async def get_balance_sheet(
+    db: AsyncSession = Depends(get_async_read_db),
     token: TokenPayload = Depends(get_current_user_payload),
+    as_of: datetime | None = None,
 ):
+    """The current balance sheet, or the one at `as_of` (covering entries dated before it)."""
     if token.role not in ["accountant", "admin"]:
         raise HTTPException(status_code=403, detail="Not authorized to view financial reports.")
 
-    asset_accounts = db.query(Account).filter(Account.type == 'Asset').all()
-    liability_accounts = db.query(Account).filter(Account.type == 'Liability').all()
-    equity_accounts = db.query(Account).filter(Account.type == 'Equity').all()
-
-    total_assets = sum(acc.balance for acc in asset_accounts)
-    total_liabilities = sum(acc.balance for acc in liability_accounts)
-    total_equity = sum(acc.balance for acc in equity_accounts)
+    accounts = await report_accounts(db, ['Asset', 'Liability', 'Equity'], end=as_of)
+    totals = type_totals(accounts)
 
     # Basic accounting equation check (can't enforce here, just for reporting)
     # total_assets should equal total_liabilities + total_equity
 
     return BalanceSheet(
-        total_assets=total_assets,
-        total_liabilities=total_liabilities,
-        total_equity=total_equity,
-        asset_lines=[ReportLine(account_name=acc.name, balance=acc.balance) for acc in asset_accounts],
-        liability_lines=[ReportLine(account_name=acc.name, balance=acc.balance) for acc in liability_accounts],
-        equity_lines=[ReportLine(account_name=acc.name, balance=acc.balance) for acc in equity_accounts],
+        total_assets=totals.get('Asset', 0),
+        total_liabilities=totals.get('Liability', 0),
+        total_equity=totals.get('Equity', 0),
+        asset_lines=report_lines(accounts, 'Asset'),
+        liability_lines=report_lines(accounts, 'Liability'),
+        equity_lines=report_lines(accounts, 'Equity'),
+    )
+
+@app.get("/reports/trial-balance", response_model=TrialBalance)
+async def get_trial_balance(
+    db: AsyncSession = Depends(get_async_read_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+    as_of: datetime | None = None,
+):
+    """Every account's balance from the journal lines, in its debit or credit column."""
+    if token.role not in ["accountant", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to view financial reports.")
+
+    as_of = as_of or datetime.utcnow()
+    accounts = balances_as_of(as_of).order_by(None).subquery()
+    # A negative balance belongs on the side opposite the account's normal balance.
+    debit = case(
+        (and_(accounts.c.normal_balance == 'debit', accounts.c.balance >= 0), accounts.c.balance),
+        (and_(accounts.c.normal_balance == 'credit', accounts.c.balance < 0), -accounts.c.balance),
+        else_=0,
+    )
+    credit = case(
+        (and_(accounts.c.normal_balance == 'credit', accounts.c.balance >= 0), accounts.c.balance),
+        (and_(accounts.c.normal_balance == 'debit', accounts.c.balance < 0), -accounts.c.balance),
+        else_=0,
+    )
+    rows = (await db.execute(
+        select(
+            accounts.c.name,
+            accounts.c.type,
+            debit.label("debit"),
+            credit.label("credit"),
+            func.sum(debit).over().label("total_debits"),
+            func.sum(credit).over().label("total_credits"),
+        ).order_by(accounts.c.type, accounts.c.name)
+    )).all()
+
+    return TrialBalance(
+        as_of=as_of,
+        total_debits=rows[0].total_debits if rows else 0,
+        total_credits=rows[0].total_credits if rows else 0,
+        lines=[
+            TrialBalanceLine(account_name=row.name, type=row.type, debit=row.debit, credit=row.credit)
+            for row in rows
+        ],
     )
+
+@app.get("/analytics/timeseries", response_model=List[TimeSeries])
+async def get_time_series(
+    db: AsyncSession = Depends(get_async_read_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+    metrics: List[str] = Query(list(ROLLUP_METRICS)),
+    granularity: str = "month",
+    project_id: int | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+):
+    """
+    Weekly or monthly series of invoiced, paid, billed and quoted amounts, for one project
+    or summed over all of them. Read from the pre-aggregated rollups, so a five-year
+    monthly chart reads at most sixty rows per metric and project.
+    """
+    if token.role not in ["accountant", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to view financial reports.")
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown granularity. Use one of: {', '.join(ROLLUP_GRANULARITIES)}.")
+    unknown = set(metrics) - set(ROLLUP_METRICS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown metric(s): {', '.join(sorted(unknown))}.")
+
+    stmt = (
+        select(
+            AnalyticsRollup.metric,
+            AnalyticsRollup.period_start,
+            func.sum(AnalyticsRollup.amount).label("amount"),
+            func.sum(AnalyticsRollup.count).label("count"),
+        )
+        .where(AnalyticsRollup.metric.in_(metrics), AnalyticsRollup.granularity == granularity)
+        .group_by(AnalyticsRollup.metric, AnalyticsRollup.period_start)
+        .order_by(AnalyticsRollup.metric, AnalyticsRollup.period_start)
+    )
+    if project_id is not None:
+        stmt = stmt.where(AnalyticsRollup.project_id == project_id)
+    if start is not None:
+        stmt = stmt.where(AnalyticsRollup.period_start >= period_start(start, granularity))
+    if end is not None:
+        stmt = stmt.where(AnalyticsRollup.period_start < end)
+
+    points = {metric: [] for metric in metrics}
+    for row in (await db.execute(stmt)).all():
+        points[row.metric].append(TimeSeriesPoint(period_start=row.period_start, amount=row.amount, count=row.count))
+    return [
+        TimeSeries(metric=metric, granularity=granularity, project_id=project_id, points=metric_points)
+        for metric, metric_points in points.items()
+    ]
+
+@app.post("/analytics/rollups/rebuild", response_model=RollupRebuildOut)
+def rebuild_time_series(
+    db: Session = Depends(get_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+):
+    """Recomputes all rollups from invoices, bills and quotations, e.g. after importing data."""
+    if token.role != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized to rebuild analytics.")
+    rollups = rebuild_rollups(db)
+    db.commit()
+    return RollupRebuildOut(rollups=rollups)
@@ -1,29 +1,49 @@
+import hmac
 import os
 import sys
+import time
+import uuid
 from datetime import datetime, timedelta
 
 from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from typing import List
 from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # This is a common pattern to make shared modules importable in a monorepo
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
 from shared.models import Base, User
-from shared.database import engine, get_db
-from shared.security import get_current_user_payload, TokenPayload
+from shared.database import engine, get_db, get_async_db, get_pool_stats
+from shared.migrations import upgrade_schema
+from shared.partitions import maintain_activity_log_partitions
+from shared.security import get_current_user_payload, verify_access_token, TokenPayload, SECRET_KEY, ALGORITHM, require_admin
+from shared.passwords import get_password_hash_async, verify_password_async, password_pool
+from shared.revocation import create_revocation_store
 
 # --- Configuration ---
-SECRET_KEY = os.getenv("SECRET_KEY", "a-very-secret-key")
-ALGORITHM = "HS256"
+# Tokens are signed with the same key and algorithm every service verifies them with.
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+
+# Refresh tokens are single-use: each refresh revokes the presented token and issues a
+# new one in the same family. Only revocations are stored (see shared/revocation.py).
+revocation_store = create_revocation_store(engine=engine)
+
+# Services calling /token/introspect authenticate with this key in the X-Service-Key
+# header. While it is unset, introspection is refused.
+INTROSPECTION_SERVICE_KEY = os.getenv("INTROSPECTION_SERVICE_KEY")
 
 # Create tables on startup (only the auth service should be responsible for this)
 Base.metadata.create_all(bind=engine)
+# ...and add the columns and indexes that existing tables are missing.
+upgrade_schema(engine)
+# A partitioned activity log needs its partitions before the first insert.
+maintain_activity_log_partitions(engine)
 
 # --- Pydantic Schemas ---
 class UserCreate(BaseModel):
@@ -44,10 +64,29 @@ class UserOut(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class IntrospectRequest(BaseModel):
+    token: str
+
+class IntrospectionOut(BaseModel):
+    active: bool
+    token_type: str | None = None # 'access' or 'refresh'
+    sub: str | None = None
+    role: str | None = None
+    uid: int | None = None
+    exp: int | None = None
 
 # --- Security ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+service_key_header = APIKeyHeader(name="X-Service-Key", auto_error=False)
+
+def require_service_key(key: str | None = Depends(service_key_header)):
+    if not INTROSPECTION_SERVICE_KEY or key is None or not hmac.compare_digest(key, INTROSPECTION_SERVICE_KEY):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="A valid service key is required.")
 
 # --- FastAPI App ---
 app = FastAPI()
@@ -63,15 +102,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Last-Write"],
 )
 
-# --- Utility Functions ---
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
+@app.on_event("shutdown")
+def shutdown_password_pool():
+    password_pool.shutdown()
 
+# --- Utility Functions ---
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -82,18 +120,59 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_refresh_token(claims: dict, family: str | None = None):
+    expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode = {
+        **claims,
+        "type": "refresh",
+        "jti": uuid.uuid4().hex,
+        # All tokens rotated from one login share a family, so a session can be revoked as a whole.
+        "fam": family or uuid.uuid4().hex,
+        "exp": expire,
+    }
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+def issue_tokens(claims: dict, family: str | None = None) -> dict:
+    access_token = create_access_token(data=claims, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    refresh_token = create_refresh_token(claims, family)
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+def decode_refresh_token(token: str) -> dict:
+    """Validates a refresh token's signature, expiry and type. This is the whole cost of a refresh."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        payload = {}
+    if payload.get("type") != "refresh" or not payload.get("jti") or not payload.get("fam"):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return payload
+
+def revoke_family(family: str):
+    # Outlives every token of the family issued so far.
+    revocation_store.revoke(f"fam:{family}", time.time() + REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+
 # --- API Endpoints ---
 @app.get("/")
 def read_root():
     return {"service": "Authentication Service", "status": "running"}
 
+@app.get("/pool-stats", dependencies=[Depends(require_admin)])
+def read_pool_stats():
+    return get_pool_stats()
+
+# Password hashing runs in a process pool (see shared/passwords.py), so these
+# endpoints are async and await it rather than blocking a threadpool thread.
 @app.post("/users/", response_model=UserOut)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.scalar(select(User).where(User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     new_user = User(
         username=user.username,
         email=user.email,
@@ -101,24 +180,85 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
         role=user.role,
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 @app.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.username == form_data.username))
+    if not user or not await verify_password_async(form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username, "role": user.role}, expires_delta=access_token_expires
+    return issue_tokens({"sub": user.username, "role": user.role, "uid": user.id})
+
+@app.post("/token/refresh", response_model=Token)
+def refresh_access_token(body: RefreshRequest, db: Session = Depends(get_db)):
+    """
+    Exchanges a refresh token for a new access token and a new refresh token.
+    No password check: a signature check, a revocation lookup and a primary-key read
+    of the user, whose current username and role go into the new tokens. A deleted
+    user's session is revoked.
+    """
+    payload = decode_refresh_token(body.refresh_token)
+    revoked_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Refresh token has been revoked",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if revocation_store.is_revoked(f"fam:{payload['fam']}"):
+        raise revoked_exception
+    if not revocation_store.revoke(f"jti:{payload['jti']}", payload["exp"]):
+        # A rotated-out token was presented again, so it has leaked: end the whole session.
+        revoke_family(payload["fam"])
+        raise revoked_exception
+
+    if payload.get("uid") is not None:
+        user = db.get(User, payload["uid"])
+    else:
+        user = db.query(User).filter(User.username == payload["sub"]).first()
+    if user is None:
+        revoke_family(payload["fam"])
+        raise revoked_exception
+
+    claims = {"sub": user.username, "role": user.role, "uid": user.id}
+    return issue_tokens(claims, family=payload["fam"])
+
+@app.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+def revoke_refresh_token(body: RefreshRequest):
+    """Logs a session out by revoking its refresh token family."""
+    payload = decode_refresh_token(body.refresh_token)
+    revoke_family(payload["fam"])
+    return None
+
+@app.post("/token/introspect", response_model=IntrospectionOut, dependencies=[Depends(require_service_key)])
+def introspect_token(body: IntrospectRequest):
+    """
+    Reports whether a token is active, to services holding INTROSPECTION_SERVICE_KEY.
+    Access tokens are answered from the shared token cache.
+    """
+    try:
+        payload = verify_access_token(body.token)
+        return IntrospectionOut(active=True, token_type="access", **payload.dict())
+    except HTTPException:
+        pass
+    try:
+        payload = decode_refresh_token(body.token)
+    except HTTPException:
+        return IntrospectionOut(active=False)
+    if revocation_store.is_revoked(f"jti:{payload['jti']}") or revocation_store.is_revoked(f"fam:{payload['fam']}"):
+        return IntrospectionOut(active=False)
+    return IntrospectionOut(
+        active=True,
+        token_type="refresh",
+        sub=payload["sub"],
+        role=payload.get("role"),
+        uid=payload.get("uid"),
+        exp=payload["exp"],
     )
-    return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/users/", response_model=List[UserOut])
 def read_users(
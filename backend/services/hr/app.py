@@ -10,9 +10,9 @@ from sqlalchemy.orm import Session
 
 # Add parent directory to path to import shared modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from shared.database import get_db
-from shared.models import Employee, LeaveRequest, User
-from shared.security import get_current_user_payload, TokenPayload
+from shared.database import get_db, get_read_db, get_pool_stats
+from shared.models import Employee, LeaveRequest, User, MoneyAmount
+from shared.security import get_current_user_payload, get_current_user, CurrentUser, TokenPayload, require_admin
 
 # --- FastAPI App ---
 app = FastAPI()
@@ -25,6 +25,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Last-Write"],
 )
 
 # --- Pydantic Schemas ---
@@ -34,7 +35,7 @@ class EmployeeCreate(BaseModel):
     job_title: str
     phone_number: str | None = None
     address: str | None = None
-    salary: float
+    salary: MoneyAmount
     emergency_contact_name: str | None = None
     emergency_contact_phone: str | None = None
 
@@ -70,6 +71,10 @@ class LeaveRequestOut(BaseModel):
 def read_root():
     return {"service": "HR Service", "status": "running"}
 
+@app.get("/pool-stats", dependencies=[Depends(require_admin)])
+def read_pool_stats():
+    return get_pool_stats()
+
 @app.post("/employees/", response_model=EmployeeOut, status_code=status.HTTP_201_CREATED)
 def create_employee_profile(
     employee: EmployeeCreate,
@@ -93,13 +98,13 @@ def create_employee_profile(
 def create_leave_request(
     request: LeaveRequestCreate,
     db: Session = Depends(get_db),
-    token: TokenPayload = Depends(get_current_user_payload),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    user = db.query(User).filter(User.username == token.sub).first()
-    if not user or not user.employee_profile:
+    employee_id = db.query(Employee.id).filter(Employee.user_id == current_user.id).scalar()
+    if employee_id is None:
         raise HTTPException(status_code=404, detail="Employee profile not found for current user.")
 
-    new_request = LeaveRequest(**request.dict(), employee_id=user.employee_profile.id)
+    new_request = LeaveRequest(**request.dict(), employee_id=employee_id)
     db.add(new_request)
     db.commit()
     db.refresh(new_request)
@@ -107,7 +112,7 @@ def create_leave_request(
 
 @app.get("/leave-requests/", response_model=List[LeaveRequestOut])
 def get_all_leave_requests(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     token: TokenPayload = Depends(get_current_user_payload),
 ):
     if token.role != "admin": # In a real app, might also be 'hr_manager'
@@ -137,25 +142,25 @@ def update_leave_request_status(
 @app.get("/employees/me", response_model=EmployeeOut)
 def get_my_employee_profile(
     db: Session = Depends(get_db),
-    token: TokenPayload = Depends(get_current_user_payload),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    user = db.query(User).filter(User.username == token.sub).first()
-    if not user or not user.employee_profile:
+    employee = db.query(Employee).filter(Employee.user_id == current_user.id).first()
+    if not employee:
         raise HTTPException(status_code=404, detail="Employee profile not found for current user.")
-    return user.employee_profile
+    return employee
 
 @app.get("/leave-requests/me", response_model=List[LeaveRequestOut])
 def get_my_leave_requests(
     db: Session = Depends(get_db),
-    token: TokenPayload = Depends(get_current_user_payload),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
-    user = db.query(User).filter(User.username == token.sub).first()
-    # If a user exists but has no employee profile, they have no leave requests.
-    # Return an empty list instead of raising an error.
-    if not user or not user.employee_profile:
-        return []
-
-    return user.employee_profile.leave_requests
+    # A user without an employee profile simply has no leave requests.
+    return (
+        db.query(LeaveRequest)
+        .join(Employee, LeaveRequest.employee_id == Employee.id)
+        .filter(Employee.user_id == current_user.id)
+        .all()
+    )
 
 @app.put("/employees/{employee_id}", response_model=EmployeeOut)
 def update_employee_profile(
@@ -1,22 +1,30 @@
 import os
 import sys
 from typing import List
+from datetime import datetime
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 # Add parent directory to path to import shared modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from shared.database import get_db
-from shared.models import Project, User
-from shared.security import get_current_user_payload, TokenPayload, oauth2_scheme
-from shared.activity_logger import log_activity
+from shared.database import get_db, get_async_read_db, get_pool_stats
+from shared.models import Project, MoneyAmount
+from shared.security import get_current_user_payload, get_current_user, CurrentUser, TokenPayload, oauth2_scheme, require_admin
+from shared.activity_logger import log_activity, close_activity_logger
 
 # --- FastAPI App ---
 app = FastAPI()
 
+@app.on_event("shutdown")
+async def shutdown_activity_logger():
+    # Deliver any queued activity events before the worker exits.
+    await close_activity_logger()
+
 # --- CORS Middleware ---
 origins = [
     "http://localhost:3000",
@@ -28,13 +36,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-DB-Last-Write"],
 )
 
 # --- Pydantic Schemas ---
 class ProjectCreate(BaseModel):
     name: str
     description: str | None = None
-    budget: float
+    budget: MoneyAmount
 
 class ProjectOut(BaseModel):
     id: int
@@ -46,24 +55,73 @@ class ProjectOut(BaseModel):
     class Config:
         orm_mode = True
 
+class ProjectSummary(BaseModel):
+    """A project without its description, for list views."""
+    id: int
+    name: str
+    budget: float
+    actual_cost: float | None = None
+    start_date: datetime | None = None
+    end_date: datetime | None = None
+    percentage_complete: float | None = None
+    manager_id: int | None = None
+
+    class Config:
+        orm_mode = True
+
+# --- Listing ---
+def filter_projects(
+    stmt,
+    manager_id: int | None = None,
+    started_since: datetime | None = None,
+    started_until: datetime | None = None,
+    min_complete: float | None = None,
+    max_complete: float | None = None,
+    cursor: int | None = None,
+):
+    """Applies the list filters, and the keyset position, to a newest-first Project query."""
+    if manager_id is not None:
+        stmt = stmt.where(Project.manager_id == manager_id)
+    if started_since is not None:
+        stmt = stmt.where(Project.start_date >= started_since)
+    if started_until is not None:
+        stmt = stmt.where(Project.start_date < started_until)
+    if min_complete is not None:
+        stmt = stmt.where(Project.percentage_complete >= min_complete)
+    if max_complete is not None:
+        stmt = stmt.where(Project.percentage_complete <= max_complete)
+    if cursor is not None:
+        stmt = stmt.where(Project.id < cursor)
+    return stmt.order_by(Project.id.desc())
+
+async def list_projects(db: AsyncSession, response: Response, columns, limit: int, *filters) -> list:
+    """
+    One page of plain rows holding only `columns`: no ORM objects and no identity map.
+    Sets X-Next-Cursor when there may be a following page.
+    """
+    stmt = filter_projects(select(*columns), *filters)
+    rows = (await db.execute(stmt.limit(limit))).all()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    return rows
+
 # --- API Endpoints ---
 @app.get("/")
 def read_root():
     return {"service": "Projects Service", "status": "running"}
 
+@app.get("/pool-stats", dependencies=[Depends(require_admin)])
+def read_pool_stats():
+    return get_pool_stats()
+
 @app.post("/projects/", response_model=ProjectOut, status_code=status.HTTP_201_CREATED)
 async def create_project(
     project: ProjectCreate,
     db: Session = Depends(get_db),
-    token_payload: TokenPayload = Depends(get_current_user_payload),
+    current_user: CurrentUser = Depends(get_current_user), # The manager to associate
     token: str = Depends(oauth2_scheme), # Get raw token for logging
 ):
-    # Find the user to associate as the manager
-    user = db.query(User).filter(User.username == token_payload.sub).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Manager user not found")
-
-    new_project = Project(**project.dict(), manager_id=user.id)
+    new_project = Project(**project.dict(), manager_id=current_user.id)
     db.add(new_project)
     db.commit()
     db.refresh(new_project)
@@ -74,13 +132,57 @@ async def create_project(
     return new_project
 
 @app.get("/projects/", response_model=List[ProjectOut])
-def get_all_projects(
-    db: Session = Depends(get_db),
+async def get_all_projects(
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
     token_payload: TokenPayload = Depends(get_current_user_payload),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: int | None = None, # id of the last project already received
+    manager_id: int | None = None,
+    started_since: datetime | None = None,
+    started_until: datetime | None = None,
+    min_complete: float | None = None, # percentage_complete bounds, inclusive
+    max_complete: float | None = None,
 ):
+    """
+    Newest-first projects, one page at a time. Pass the X-Next-Cursor header of a
+    response as `cursor` to fetch the following page.
+    """
     # In a real app, you might filter by user or role
-    projects = db.query(Project).all()
-    return projects
+    columns = (Project.id, Project.name, Project.description, Project.budget, Project.manager_id)
+    return await list_projects(
+        db, response, columns, limit,
+        manager_id, started_since, started_until, min_complete, max_complete, cursor,
+    )
+
+@app.get("/projects/summary", response_model=List[ProjectSummary])
+async def get_project_summaries(
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
+    token_payload: TokenPayload = Depends(get_current_user_payload),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: int | None = None,
+    manager_id: int | None = None,
+    started_since: datetime | None = None,
+    started_until: datetime | None = None,
+    min_complete: float | None = None,
+    max_complete: float | None = None,
+):
+    """Like GET /projects/, without the description but with dates, cost and progress."""
+    columns = (
+        Project.id,
+        Project.name,
+        Project.budget,
+        Project.actual_cost,
+        Project.start_date,
+        Project.end_date,
+        Project.percentage_complete,
+        Project.manager_id,
+    )
+    return await list_projects(
+        db, response, columns, limit,
+        manager_id, started_since, started_until, min_complete, max_complete, cursor,
+    )
 
 @app.get("/projects/{project_id}", response_model=ProjectOut)
 def get_project(
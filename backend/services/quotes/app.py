@@ -1,17 +1,23 @@
 import os
 import sys
 from typing import List
+from datetime import datetime
+from decimal import Decimal
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 
 # Add parent directory to path to import shared modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from shared.database import get_db
-from shared.models import Quotation, QuotationItem, Project, User
-from shared.security import get_current_user_payload, TokenPayload
+from shared.database import get_db, get_async_read_db, get_pool_stats
+from shared.models import Quotation, QuotationItem, Project, Invoice, Account, MoneyAmount, QuantityAmount
+from shared.ledger import Posting, PostingLine, post_journal_entries
+from shared.rollups import record_rollup
+from shared.security import get_current_user_payload, get_current_user, CurrentUser, TokenPayload, require_admin
 
 # --- FastAPI App ---
 app = FastAPI()
@@ -24,19 +30,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-DB-Last-Write"],
 )
 
 # --- Pydantic Schemas ---
 class QuotationItemBase(BaseModel):
     description: str
-    quantity: float
-    unit_price: float
 
 class QuotationItemCreate(QuotationItemBase):
-    pass
+    quantity: QuantityAmount
+    unit_price: MoneyAmount
 
 class QuotationItemOut(QuotationItemBase):
     id: int
+    quantity: float
+    unit_price: float
     class Config: orm_mode = True
 
 class QuotationCreate(BaseModel):
@@ -54,51 +62,286 @@ class QuotationOut(BaseModel):
     items: List[QuotationItemOut]
     class Config: orm_mode = True
 
+class QuotationSummary(BaseModel):
+    """A quotation without its items, for list views."""
+    id: int
+    client_name: str
+    status: str
+    total_amount: float
+    created_date: datetime | None = None
+    project_id: int | None = None
+    created_by_id: int | None = None
+    class Config: orm_mode = True
+
+class QuotationBulkResult(BaseModel):
+    created: int
+    ids: List[int]
+
+class MilestoneCreate(BaseModel):
+    percentage: Decimal # Share of the quotation total invoiced at this milestone
+    due_date: datetime | None = None
+
+class QuotationAccept(BaseModel):
+    project_name: str | None = None # Defaults to the client's name
+    project_description: str | None = None
+    milestones: List[MilestoneCreate] = [] # Defaults to one invoice for the full amount
+
+class QuotationAcceptOut(BaseModel):
+    quotation_id: int
+    project_id: int
+    invoice_ids: List[int]
+    journal_entry_ids: List[int]
+
+# --- Writing ---
+def refresh_quotation_totals(db: Session, quote_ids) -> list:
+    """
+    Sets each quotation's total_amount to the sum of its items in one UPDATE, so the
+    total is always what the database holds. Returns (id, project_id, created_date,
+    total_amount) for each updated quotation.
+    """
+    items_total = (
+        select(func.coalesce(func.round(func.sum(QuotationItem.quantity * QuotationItem.unit_price), 2), 0))
+        .where(QuotationItem.quotation_id == Quotation.id)
+        .scalar_subquery()
+    )
+    return db.execute(
+        update(Quotation)
+        .where(Quotation.id.in_(quote_ids))
+        .values(total_amount=items_total)
+        .returning(Quotation.id, Quotation.project_id, Quotation.created_date, Quotation.total_amount)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+def insert_quotations(db: Session, quotes: List[QuotationCreate], created_by_id: int) -> List[int]:
+    """
+    Creates quotations and their items with one multi-row INSERT each, then computes
+    all totals with a single aggregate UPDATE. Returns the new ids in input order.
+    Raises a 404 listing the positions of quotations quoted for a project that does not exist.
+    """
+    project_ids = {quote.project_id for quote in quotes if quote.project_id is not None}
+    if project_ids:
+        existing = set(db.scalars(select(Project.id).where(Project.id.in_(project_ids))))
+        invalid = [i for i, quote in enumerate(quotes) if quote.project_id is not None and quote.project_id not in existing]
+        if invalid:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Project(s) not found for the quotation(s) at index {', '.join(map(str, invalid))}.",
+            )
+
+    now = datetime.utcnow()
+    quote_ids = db.execute(
+        insert(Quotation).returning(Quotation.id, sort_by_parameter_order=True),
+        [
+            {
+                "client_name": quote.client_name,
+                "project_id": quote.project_id,
+                "total_amount": 0,
+                "created_by_id": created_by_id,
+                "created_date": now,
+                "status": "draft",
+            }
+            for quote in quotes
+        ],
+    ).scalars().all()
+
+    item_rows = [
+        {**item.dict(), "quotation_id": quote_id}
+        for quote_id, quote in zip(quote_ids, quotes)
+        for item in quote.items
+    ]
+    if item_rows:
+        db.execute(insert(QuotationItem), item_rows)
+
+    # One rollup upsert per project rather than per quotation.
+    quoted = {}
+    for _, project_id, _, total_amount in refresh_quotation_totals(db, quote_ids):
+        amount, count = quoted.get(project_id, (0, 0))
+        quoted[project_id] = (amount + total_amount, count + 1)
+    for project_id, (amount, count) in quoted.items():
+        record_rollup(db, "quoted", project_id, now, amount, count=count)
+    return quote_ids
+
+def reprice_quotation(db: Session, quote: Quotation):
+    """Recomputes a quotation's total after its items changed, and moves its rollup by the difference."""
+    old_total = quote.total_amount
+    _, project_id, created_date, new_total = refresh_quotation_totals(db, [quote.id])[0]
+    if new_total != old_total and created_date is not None:
+        record_rollup(db, "quoted", project_id, created_date, new_total - old_total, count=0)
+
+def milestone_amounts(total: Decimal, milestones: List[MilestoneCreate]) -> List[Decimal]:
+    """
+    Splits `total` by the milestone percentages in cents. The last milestone takes the
+    rounding remainder. With tiny totals a milestone can come out at zero, so callers
+    check the amounts.
+    """
+    amounts = [(total * m.percentage / 100).quantize(Decimal("0.01")) for m in milestones[:-1]]
+    return amounts + [total - sum(amounts, Decimal(0))]
+
+# --- Listing ---
+def filter_quotations(
+    stmt,
+    status: str | None = None,
+    client_name: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    cursor: int | None = None,
+):
+    """Applies the list filters, and the keyset position, to a newest-first Quotation query."""
+    if status is not None:
+        stmt = stmt.where(Quotation.status == status)
+    if client_name is not None:
+        stmt = stmt.where(Quotation.client_name.ilike(f"%{client_name}%"))
+    if since is not None:
+        stmt = stmt.where(Quotation.created_date >= since)
+    if until is not None:
+        stmt = stmt.where(Quotation.created_date < until)
+    if cursor is not None:
+        stmt = stmt.where(Quotation.id < cursor)
+    return stmt.order_by(Quotation.id.desc())
+
 # --- API Endpoints ---
 @app.get("/")
 def read_root():
     return {"service": "Quotes Service", "status": "running"}
 
+@app.get("/pool-stats", dependencies=[Depends(require_admin)])
+def read_pool_stats():
+    return get_pool_stats()
+
 @app.post("/quotes/", response_model=QuotationOut, status_code=status.HTTP_201_CREATED)
 def create_quotation(
     quote: QuotationCreate,
     db: Session = Depends(get_db),
     token: TokenPayload = Depends(get_current_user_payload),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     if token.role not in ["sales", "admin"]:
         raise HTTPException(status_code=403, detail="Not authorized to create quotations.")
 
-    user = db.query(User).filter(User.username == token.sub).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Creator user not found.")
+    # The total is computed by the database from the items, never taken from the client
+    quote_id = insert_quotations(db, [quote], current_user.id)[0]
+    db.commit()
+    return db.get(Quotation, quote_id)
+
+@app.post("/quotes/bulk", response_model=QuotationBulkResult, status_code=status.HTTP_201_CREATED)
+def create_quotations_bulk(
+    quotes: List[QuotationCreate],
+    db: Session = Depends(get_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    """
+    Creates many quotations in one transaction, e.g. a tender with thousands of BOQ
+    lines: one INSERT for the quotations, one for all items, one UPDATE for the totals.
+    """
+    if token.role not in ["sales", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to create quotations.")
+    if not quotes:
+        return QuotationBulkResult(created=0, ids=[])
 
-    # Calculate total amount on the backend for security
-    total_amount = sum(item.quantity * item.unit_price for item in quote.items)
+    quote_ids = insert_quotations(db, quotes, current_user.id)
+    db.commit()
+    return QuotationBulkResult(created=len(quote_ids), ids=quote_ids)
 
-    db_quote = Quotation(
-        client_name=quote.client_name,
-        project_id=quote.project_id,
-        total_amount=total_amount,
-        created_by_id=user.id,
-    )
+@app.post("/quotes/{quote_id}/items", response_model=QuotationOut, status_code=status.HTTP_201_CREATED)
+def add_quotation_items(
+    quote_id: int,
+    items: List[QuotationItemCreate],
+    db: Session = Depends(get_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+):
+    if token.role not in ["sales", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to modify quotations.")
+    db_quote = db.get(Quotation, quote_id)
+    if not db_quote:
+        raise HTTPException(status_code=404, detail="Quotation not found.")
 
-    db.add(db_quote)
-    db.flush() # Flush to get the db_quote.id for the items
+    if db_quote.status == "accepted":
+        raise HTTPException(status_code=409, detail="An accepted quotation cannot be changed.")
 
-    for item in quote.items:
-        db_item = QuotationItem(**item.dict(), quotation_id=db_quote.id)
-        db.add(db_item)
+    if items:
+        db.execute(insert(QuotationItem), [{**item.dict(), "quotation_id": quote_id} for item in items])
+        reprice_quotation(db, db_quote)
+    db.commit()
+    return db_quote
 
+@app.delete("/quotes/{quote_id}/items/{item_id}", response_model=QuotationOut)
+def delete_quotation_item(
+    quote_id: int,
+    item_id: int,
+    db: Session = Depends(get_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+):
+    if token.role not in ["sales", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to modify quotations.")
+    db_quote = db.get(Quotation, quote_id)
+    if not db_quote:
+        raise HTTPException(status_code=404, detail="Quotation not found.")
+
+    if db_quote.status == "accepted":
+        raise HTTPException(status_code=409, detail="An accepted quotation cannot be changed.")
+
+    deleted = db.execute(
+        delete(QuotationItem).where(QuotationItem.id == item_id, QuotationItem.quotation_id == quote_id)
+    ).rowcount
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Quotation item not found.")
+    reprice_quotation(db, db_quote)
     db.commit()
-    db.refresh(db_quote)
     return db_quote
 
 @app.get("/quotes/", response_model=List[QuotationOut])
-def get_all_quotations(
-    db: Session = Depends(get_db),
+async def get_all_quotations(
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
     token: TokenPayload = Depends(get_current_user_payload),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: int | None = None, # id of the last quotation already received
+    status: str | None = None,
+    client_name: str | None = None, # matches any part of the name, ignoring case
+    since: datetime | None = None,
+    until: datetime | None = None,
 ):
-    return db.query(Quotation).all()
+    """
+    Newest-first quotations with their items, one page at a time. Each page is two
+    queries: the quotations, then all of their items. Pass the X-Next-Cursor header
+    of a response as `cursor` to fetch the following page.
+    """
+    # Items are part of the response model and cannot be lazy-loaded on an AsyncSession.
+    stmt = filter_quotations(select(Quotation), status, client_name, since, until, cursor)
+    result = await db.execute(stmt.options(selectinload(Quotation.items)).limit(limit))
+    quotes = result.scalars().all()
+    if len(quotes) == limit:
+        response.headers["X-Next-Cursor"] = str(quotes[-1].id)
+    return quotes
+
+@app.get("/quotes/summary", response_model=List[QuotationSummary])
+async def get_quotation_summaries(
+    response: Response,
+    db: AsyncSession = Depends(get_async_read_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: int | None = None,
+    status: str | None = None,
+    client_name: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """Like GET /quotes/, without items: one query selecting only the listed columns."""
+    columns = select(
+        Quotation.id,
+        Quotation.client_name,
+        Quotation.status,
+        Quotation.total_amount,
+        Quotation.created_date,
+        Quotation.project_id,
+        Quotation.created_by_id,
+    )
+    stmt = filter_quotations(columns, status, client_name, since, until, cursor)
+    rows = (await db.execute(stmt.limit(limit))).all()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    return rows
 
 @app.get("/quotes/{quote_id}", response_model=QuotationOut)
 def get_quotation(
@@ -110,3 +353,101 @@ def get_quotation(
     if not db_quote:
         raise HTTPException(status_code=404, detail="Quotation not found.")
     return db_quote
+
+@app.post("/quotes/{quote_id}/accept", response_model=QuotationAcceptOut, status_code=status.HTTP_201_CREATED)
+def accept_quotation(
+    quote_id: int,
+    acceptance: QuotationAccept,
+    db: Session = Depends(get_db),
+    token: TokenPayload = Depends(get_current_user_payload),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    """
+    Accepts a quotation and, in one transaction, turns it into a project (or raises the
+    budget of the project it was quoted for), creates its milestone invoices and posts
+    their journal entries. The number of round-trips does not grow with the milestones.
+    Since it invoices and posts to the ledger, only accountants and admins may accept.
+    """
+    if token.role not in ["accountant", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized to accept quotations.")
+
+    # Locked so that two concurrent acceptances cannot both convert the quote.
+    db_quote = db.execute(select(Quotation).where(Quotation.id == quote_id).with_for_update()).scalar_one_or_none()
+    if not db_quote:
+        raise HTTPException(status_code=404, detail="Quotation not found.")
+    if db_quote.status in ("accepted", "rejected"):
+        raise HTTPException(status_code=409, detail=f"The quotation is already {db_quote.status}.")
+    if db_quote.total_amount <= 0:
+        raise HTTPException(status_code=400, detail="A quotation without a total cannot be accepted.")
+
+    milestones = acceptance.milestones or [MilestoneCreate(percentage=Decimal(100))]
+    if any(m.percentage <= 0 for m in milestones) or sum(m.percentage for m in milestones) != 100:
+        raise HTTPException(status_code=400, detail="Milestone percentages must be positive and add up to 100.")
+    amounts = milestone_amounts(db_quote.total_amount, milestones)
+    if any(amount <= 0 for amount in amounts):
+        raise HTTPException(status_code=400, detail="Every milestone must invoice at least 0.01; use fewer milestones.")
+
+    accounts = {
+        row.name: row
+        for row in db.execute(
+            select(Account.id, Account.name, Account.normal_balance)
+            .where(Account.name.in_(["Accounts Receivable", "Sales Revenue"]))
+        )
+    }
+    ar_acc, revenue_acc = accounts.get("Accounts Receivable"), accounts.get("Sales Revenue")
+    if not ar_acc or not revenue_acc:
+        raise HTTPException(status_code=500, detail="Core accounting accounts ('Accounts Receivable' or 'Sales Revenue') not found.")
+
+    # --- Project and budget ---
+    total = db_quote.total_amount
+    if db_quote.project_id is not None:
+        project = db.get(Project, db_quote.project_id)
+        if project is None:
+            raise HTTPException(status_code=409, detail=f"The quotation's project {db_quote.project_id} no longer exists.")
+        project.budget = Project.budget + total
+    else:
+        project = Project(
+            name=acceptance.project_name or db_quote.client_name,
+            description=acceptance.project_description,
+            budget=total,
+            manager_id=current_user.id,
+        )
+        db.add(project)
+    db.flush()
+
+    # --- Milestone invoices ---
+    now = datetime.utcnow()
+    invoice_ids = db.execute(
+        insert(Invoice).returning(Invoice.id, sort_by_parameter_order=True),
+        [
+            {"amount": amount, "status": "pending", "due_date": m.due_date, "created_date": now, "project_id": project.id}
+            for amount, m in zip(amounts, milestones)
+        ],
+    ).scalars().all()
+
+    # --- Journal entries: debit Accounts Receivable, credit Sales Revenue, per invoice ---
+    postings = [
+        Posting(
+            description=f"Invoice {invoice_id} for project {project.name} (quotation {db_quote.id})",
+            date=now,
+            lines=[
+                PostingLine(ar_acc.id, "debit", amount),
+                PostingLine(revenue_acc.id, "credit", amount),
+            ],
+        )
+        for invoice_id, amount in zip(invoice_ids, amounts)
+    ]
+    normal_balances = {ar_acc.id: ar_acc.normal_balance, revenue_acc.id: revenue_acc.normal_balance}
+    entry_ids = post_journal_entries(db, postings, normal_balances)
+    # After the balances, so the hot rollup row is locked only until the commit.
+    record_rollup(db, "invoiced", project.id, now, total, count=len(invoice_ids))
+
+    db_quote.status = "accepted"
+    db_quote.project_id = project.id
+    db.commit()
+    return QuotationAcceptOut(
+        quotation_id=db_quote.id,
+        project_id=project.id,
+        invoice_ids=invoice_ids,
+        journal_entry_ids=entry_ids,
+    )
@@ -9,14 +9,19 @@ from sqlalchemy.orm import Session
 
 # Add parent directory to path to import shared modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from shared.database import get_db
+from shared.database import get_db, get_pool_stats
 from shared.models import Task, Project, User
-from shared.security import get_current_user_payload, TokenPayload, oauth2_scheme
-from shared.activity_logger import log_activity
+from shared.security import get_current_user_payload, get_current_user, CurrentUser, TokenPayload, oauth2_scheme, require_admin
+from shared.activity_logger import log_activity, close_activity_logger
 
 # --- FastAPI App ---
 app = FastAPI()
 
+@app.on_event("shutdown")
+async def shutdown_activity_logger():
+    # Deliver any queued activity events before the worker exits.
+    await close_activity_logger()
+
 # --- CORS Middleware ---
 origins = ["http://localhost:3000"]
 app.add_middleware(
@@ -25,6 +30,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Last-Write"],
 )
 
 # --- Pydantic Schemas ---
@@ -49,22 +55,23 @@ class TaskOut(BaseModel):
 def read_root():
     return {"service": "Tasks Service", "status": "running"}
 
+@app.get("/pool-stats", dependencies=[Depends(require_admin)])
+def read_pool_stats():
+    return get_pool_stats()
+
 @app.post("/tasks/", response_model=TaskOut, status_code=status.HTTP_201_CREATED)
 def create_task(
     task: TaskCreate,
     db: Session = Depends(get_db),
     token: TokenPayload = Depends(get_current_user_payload),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     # Authorization: Check if user is manager of the project or an admin
     project = db.query(Project).filter(Project.id == task.project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found.")
 
-    user = db.query(User).filter(User.username == token.sub).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Current user not found.")
-
-    if project.manager_id != user.id and token.role != "admin":
+    if project.manager_id != current_user.id and token.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized to create tasks for this project.")
 
     # Check if assignee exists
@@ -94,6 +101,7 @@ async def update_task_status(
     task_update: TaskUpdate,
     db: Session = Depends(get_db),
     token_payload: TokenPayload = Depends(get_current_user_payload),
+    current_user: CurrentUser = Depends(get_current_user),
     token: str = Depends(oauth2_scheme), # Get raw token for logging
 ):
     db_task = db.query(Task).filter(Task.id == task_id).first()
@@ -101,12 +109,8 @@ async def update_task_status(
         raise HTTPException(status_code=404, detail="Task not found.")
 
     # Authorization: Check if user is assignee, manager, or admin
-    user = db.query(User).filter(User.username == token_payload.sub).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Current user not found.")
-
-    if (db_task.assigned_to_id != user.id and
-        db_task.project.manager_id != user.id and
+    if (db_task.assigned_to_id != current_user.id and
+        db_task.project.manager_id != current_user.id and
         token_payload.role != "admin"):
         raise HTTPException(status_code=403, detail="Not authorized to update this task.")
 
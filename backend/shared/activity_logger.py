@@ -1,20 +1,165 @@
+import asyncio
 import os
+from datetime import datetime
+
 import httpx
 
 ACTIVITY_SERVICE_URL = os.getenv("ACTIVITY_SERVICE_URL", "http://localhost:8008/activities/")
+ACTIVITY_BATCH_URL = os.getenv("ACTIVITY_BATCH_URL", ACTIVITY_SERVICE_URL.rstrip("/") + "/batch")
+
+# --- Batching Configuration ---
+# Events are queued in memory and shipped by a background task, so logging never
+# adds the activity service's latency to the caller's request.
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "1.0"))  # seconds
+ACTIVITY_BATCH_SIZE = int(os.getenv("ACTIVITY_BATCH_SIZE", "100"))  # flush early at this many queued events
+ACTIVITY_QUEUE_SIZE = int(os.getenv("ACTIVITY_QUEUE_SIZE", "10000"))
+# When the queue is full, callers wait at most this long for space before the event is dropped.
+ACTIVITY_ENQUEUE_TIMEOUT = float(os.getenv("ACTIVITY_ENQUEUE_TIMEOUT", "0.05"))
+ACTIVITY_HTTP_TIMEOUT = float(os.getenv("ACTIVITY_HTTP_TIMEOUT", "5.0"))
+# Batches that fail with a transport error or a 5xx are queued again, up to this many times.
+ACTIVITY_MAX_RETRIES = int(os.getenv("ACTIVITY_MAX_RETRIES", "3"))
+
+_loop: asyncio.AbstractEventLoop | None = None
+_client: httpx.AsyncClient | None = None
+_queue: asyncio.Queue | None = None
+_flush_requested: asyncio.Event | None = None
+_flusher: asyncio.Task | None = None
+_stopping = False
+dropped_events = 0
+
+
+def _ensure_started():
+    """Lazily creates the shared client, queue and flusher on the running event loop."""
+    global _loop, _client, _queue, _flush_requested, _flusher, _stopping
+    loop = asyncio.get_running_loop()
+    if _loop is loop and _flusher is not None and not _flusher.done():
+        return
+    if _loop is not loop:
+        # One keep-alive connection pool for the whole process.
+        _client = httpx.AsyncClient(
+            timeout=ACTIVITY_HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+        _queue = asyncio.Queue(maxsize=ACTIVITY_QUEUE_SIZE)
+        _flush_requested = asyncio.Event()
+        _loop = loop
+    _stopping = False
+    _flusher = loop.create_task(_flush_periodically())
+
 
 async def log_activity(token: str, action: str, details: str | None = None):
     """
-    Makes an asynchronous API call to the activity service to log an action.
+    Queues an action for the activity service and returns immediately.
+    The event keeps the time it happened, even though it is delivered later.
     """
-    headers = {"Authorization": f"Bearer {token}"}
-    payload = {"action": action, "details": details}
+    global dropped_events
+    _ensure_started()
+    event = (token, {"action": action, "details": details, "timestamp": datetime.utcnow().isoformat()}, 0)
+    try:
+        _queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # Backpressure: give the flusher a brief chance to make room, then shed load
+        # rather than stall the caller's request.
+        _flush_requested.set()
+        try:
+            await asyncio.wait_for(_queue.put(event), ACTIVITY_ENQUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            dropped_events += 1
+            print(f"Activity queue full, dropped '{action}' ({dropped_events} dropped so far)")
+            return
+    if _queue.qsize() >= ACTIVITY_BATCH_SIZE:
+        _flush_requested.set()
+
 
-    async with httpx.AsyncClient() as client:
+async def _flush_periodically():
+    while not _stopping:
         try:
-            await client.post(ACTIVITY_SERVICE_URL, json=payload, headers=headers)
-            # We can choose to log errors here if the activity service fails
-            # but for now, we'll fail silently to not interrupt the main request.
-        except httpx.RequestError as e:
-            # In a real app, you would have robust logging here.
-            print(f"Could not log activity: {e}")
+            await asyncio.wait_for(_flush_requested.wait(), ACTIVITY_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_requested.clear()
+        await flush()
+
+
+async def flush():
+    """
+    Sends everything currently queued, in batches of at most ACTIVITY_BATCH_SIZE.
+    Events queued again by a failed batch wait for the next flush.
+    """
+    pending = _queue.qsize() if _queue is not None else 0
+    while pending > 0 and not _queue.empty():
+        batch = []
+        while len(batch) < min(ACTIVITY_BATCH_SIZE, pending) and not _queue.empty():
+            batch.append(_queue.get_nowait())
+        pending -= len(batch)
+        await _send_batch(batch)
+
+
+def _drop(events: list, reason: str):
+    global dropped_events
+    dropped_events += len(events)
+    # In a real app, you would have robust logging here.
+    print(f"Could not log activity, dropped {len(events)} event(s): {reason} ({dropped_events} dropped so far)")
+
+
+def _retry(events: list, reason: str):
+    """Queues transiently failed events again, dropping those out of retries or out of room."""
+    retry = [(token, payload, attempts + 1) for token, payload, attempts in events if attempts < ACTIVITY_MAX_RETRIES]
+    dropped = [event for event in events if event[2] >= ACTIVITY_MAX_RETRIES]
+    for event in retry:
+        try:
+            _queue.put_nowait(event)
+        except asyncio.QueueFull:
+            dropped.append(event)
+    if dropped:
+        _drop(dropped, reason)
+
+
+async def _send_batch(batch: list):
+    # Each event is attributed to the user whose token it carries, so send one
+    # bulk request per distinct token in the batch.
+    by_token = {}
+    for event in batch:
+        by_token.setdefault(event[0], []).append(event)
+    results = await asyncio.gather(
+        *(
+            _client.post(
+                ACTIVITY_BATCH_URL,
+                json=[payload for _, payload, _ in events],
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            for token, events in by_token.items()
+        ),
+        return_exceptions=True,
+    )
+    for events, result in zip(by_token.values(), results):
+        if isinstance(result, httpx.RequestError):
+            _retry(events, str(result) or repr(result))
+        elif isinstance(result, Exception):
+            _drop(events, repr(result))
+        elif result.is_server_error:
+            _retry(events, f"HTTP {result.status_code}")
+        elif result.is_error:
+            # e.g. a 401 because the token expired while the event was queued: retrying cannot help.
+            _drop(events, f"HTTP {result.status_code}")
+
+
+async def close_activity_logger():
+    """
+    Stops the flusher, drains whatever is still queued and closes the HTTP client.
+    Register it as a shutdown handler in services that log activity.
+    """
+    global _loop, _client, _queue, _flusher, _stopping
+    if _loop is not asyncio.get_running_loop():
+        return
+    _stopping = True
+    if _flusher is not None:
+        _flush_requested.set()
+        await _flusher
+        _flusher = None
+    await flush()
+    leftover = [_queue.get_nowait() for _ in range(_queue.qsize())]
+    if leftover:
+        _drop(leftover, "shutting down before a retry")
+    await _client.aclose()
+    _loop = _client = _queue = None
@@ -0,0 +1,70 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from shared.database import ReadSessionLocal
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+# Rows fetched per round-trip from the server-side cursor, and written per response chunk.
+EXPORT_CHUNK_SIZE = 1000
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # A number, as in the API's JSON responses, whose money fields are floats.
+        return float(value)
+    return str(value)
+
+
+def stream_rows(stmt, fmt: str, row_to_dict, chunk_size: int = EXPORT_CHUNK_SIZE, extra_fields: tuple = ()):
+    """
+    Yields `stmt`'s rows encoded as NDJSON or CSV, a chunk at a time.
+
+    CSV starts with a header of the selected columns followed by `extra_fields`, the
+    keys `row_to_dict` adds, so an export without rows still has its header. In NDJSON,
+    dates are ISO 8601 strings and Decimals are numbers.
+
+    The query runs on its own read session with a server-side cursor, so memory stays
+    constant however many rows there are. It cannot use the request's session, because
+    the response body is produced after the endpoint has returned.
+    """
+    db = ReadSessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=chunk_size))
+        if fmt == "csv":
+            fieldnames = list(result.keys()) + list(extra_fields)
+            buffer = io.StringIO()
+            csv.DictWriter(buffer, fieldnames=fieldnames).writeheader()
+            yield buffer.getvalue()
+        for partition in result.partitions():
+            buffer = io.StringIO()
+            records = [row_to_dict(row) for row in partition]
+            if fmt == "csv":
+                csv.DictWriter(buffer, fieldnames=fieldnames).writerows(records)
+            else:
+                for record in records:
+                    buffer.write(json.dumps(record, default=_json_default))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+    finally:
+        db.close()
+
+
+def export_response(stmt, fmt: str, row_to_dict, filename: str, extra_fields: tuple = ()) -> StreamingResponse:
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}.")
+    return StreamingResponse(
+        stream_rows(stmt, fmt, row_to_dict, extra_fields=extra_fields),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
@@ -0,0 +1,344 @@
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List, NamedTuple
+
+from sqlalchemy import bindparam, case, delete, func, insert, or_, select, text, union_all, update
+from sqlalchemy.orm import Session
+
+from shared.models import Account, AccountBalanceSnapshot, JournalEntry, JournalEntryLine, LedgerReconciliation
+
+# How long reconciliation rows are kept.
+LEDGER_RECONCILIATION_RETENTION_DAYS = int(os.getenv("LEDGER_RECONCILIATION_RETENTION_DAYS", "90"))
+
+# Arbitrary key so that only one worker at a time reconciles.
+_RECONCILIATION_LOCK_KEY = 7_310_002
+# Postings hold this advisory lock shared and closing a period holds it exclusively (see lock_periods).
+_PERIOD_CLOSE_LOCK_KEY = 7_310_003
+
+
+# --- Posting ---
+class PostingLine(NamedTuple):
+    account_id: int
+    type: str # 'debit' or 'credit'
+    amount: Decimal
+
+class Posting(NamedTuple):
+    description: str
+    date: datetime | None
+    lines: List[PostingLine]
+
+
+def balance_deltas(lines, normal_balances: dict) -> dict:
+    """
+    Sums journal lines into a balance change per account. A line on the account's
+    normal side increases its balance; a line on the other side decreases it.
+    """
+    deltas = {}
+    for line in lines:
+        sign = 1 if normal_balances[line.account_id] == line.type else -1
+        deltas[line.account_id] = deltas.get(line.account_id, 0) + sign * line.amount
+    return deltas
+
+def apply_balance_deltas(db: Session, deltas: dict):
+    """
+    Adds each delta to its account's balance as `balance = balance + delta` in SQL,
+    one UPDATE per account sent as a single executemany. Accounts are updated in id
+    order so concurrent postings always lock rows in the same order.
+
+    Because the addition happens in the database, concurrent postings to the same
+    account cannot overwrite each other, and no lock is held while Python works: call
+    this last, right before commit, so the row locks last only until the commit.
+    """
+    accounts = Account.__table__
+    stmt = (
+        update(accounts)
+        .where(accounts.c.id == bindparam("account_id"))
+        .values(balance=accounts.c.balance + bindparam("delta"))
+    )
+    params = [{"account_id": account_id, "delta": delta} for account_id, delta in sorted(deltas.items()) if delta]
+    if params:
+        db.execute(stmt, params)
+
+
+def post_journal_entries(db: Session, entries, normal_balances: dict) -> List[int]:
+    """
+    Posts already validated entries (anything with `description`, `date` and `lines`,
+    e.g. Posting) in a constant number of round-trips: one INSERT for the entries,
+    one for all lines and one executemany for the balances. Returns the entry ids in
+    input order. The caller commits.
+    """
+    lock_periods(db)
+    now = datetime.utcnow()
+    entry_ids = db.execute(
+        insert(JournalEntry).returning(JournalEntry.id, sort_by_parameter_order=True),
+        [{"description": entry.description, "date": entry.date or now} for entry in entries],
+    ).scalars().all()
+
+    line_rows = [
+        {"entry_id": entry_id, "account_id": line.account_id, "type": line.type, "amount": line.amount}
+        for entry_id, entry in zip(entry_ids, entries)
+        for line in entry.lines
+    ]
+    db.execute(insert(JournalEntryLine), line_rows)
+    apply_balance_deltas(db, balance_deltas((line for entry in entries for line in entry.lines), normal_balances))
+    return entry_ids
+
+# --- Point-in-time Balances ---
+# Balances here follow the same rule as Account.balance: a line on the account's normal
+# side adds to it, a line on the other side subtracts. A balance "as of" a moment covers
+# every entry dated strictly before it, so consecutive periods never overlap.
+
+
+def signed_line_amount():
+    return case(
+        (JournalEntryLine.type == Account.normal_balance, JournalEntryLine.amount),
+        else_=-JournalEntryLine.amount,
+    )
+
+
+def latest_snapshot_at(as_of: datetime | None = None):
+    """Scalar subquery for the newest snapshot moment at or before `as_of` (any, if None)."""
+    stmt = select(func.max(AccountBalanceSnapshot.as_of))
+    if as_of is not None:
+        stmt = stmt.where(AccountBalanceSnapshot.as_of <= as_of)
+    return stmt.scalar_subquery()
+
+
+def balances_as_of(as_of: datetime):
+    """
+    Statement returning (account_id, name, type, normal_balance, balance) for every
+    account at `as_of`, in one round-trip. It starts from the latest snapshot taken at
+    or before `as_of` and adds only the lines dated between that snapshot and `as_of`,
+    so a report over years of history scans one period's worth of lines.
+    """
+    snapshot_at = latest_snapshot_at(as_of)
+    opening = select(
+        AccountBalanceSnapshot.account_id.label("account_id"),
+        AccountBalanceSnapshot.balance.label("amount"),
+    ).where(AccountBalanceSnapshot.as_of == snapshot_at)
+    movements = (
+        select(JournalEntryLine.account_id.label("account_id"), signed_line_amount().label("amount"))
+        .join(JournalEntry, JournalEntryLine.entry_id == JournalEntry.id)
+        .join(Account, JournalEntryLine.account_id == Account.id)
+        .where(JournalEntry.date < as_of)
+        .where(or_(snapshot_at.is_(None), JournalEntry.date >= snapshot_at))
+    )
+    amounts = union_all(opening, movements).subquery()
+    totals = (
+        select(amounts.c.account_id, func.sum(amounts.c.amount).label("balance"))
+        .group_by(amounts.c.account_id)
+        .subquery()
+    )
+    return (
+        select(
+            Account.id.label("account_id"),
+            Account.name,
+            Account.type,
+            Account.normal_balance,
+            func.coalesce(totals.c.balance, 0).label("balance"),
+        )
+        .outerjoin(totals, totals.c.account_id == Account.id)
+        .order_by(Account.type, Account.name)
+    )
+
+
+def balances_between(start: datetime, end: datetime):
+    """Like balances_as_of, but each account's movement over [start, end), still in one round-trip."""
+    closing = balances_as_of(end).order_by(None).subquery()
+    opening = balances_as_of(start).order_by(None).subquery()
+    return (
+        select(
+            closing.c.account_id,
+            closing.c.name,
+            closing.c.type,
+            closing.c.normal_balance,
+            (closing.c.balance - opening.c.balance).label("balance"),
+        )
+        .join(opening, opening.c.account_id == closing.c.account_id)
+        .order_by(closing.c.type, closing.c.name)
+    )
+
+
+def lock_periods(db: Session, exclusive: bool = False):
+    """
+    Takes the period-close lock until the transaction ends: shared for a posting, which
+    must take it before it checks the closing date or dates its entries, and exclusive
+    for closing a period. A close thus waits for the postings in flight and includes
+    them, and a posting that starts during a close waits and then sees the new closing
+    date. Postings do not block each other. A no-op outside Postgres.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        lock = "pg_advisory_xact_lock" if exclusive else "pg_advisory_xact_lock_shared"
+        db.execute(text(f"SELECT {lock}(:key)"), {"key": _PERIOD_CLOSE_LOCK_KEY})
+
+
+def closed_through(db: Session, exclusive: bool = False) -> datetime | None:
+    """
+    The moment up to which the books are closed by a snapshot, or None. Takes the
+    period-close lock first (see lock_periods); pass `exclusive` when about to close.
+    """
+    lock_periods(db, exclusive)
+    return db.scalar(select(latest_snapshot_at()))
+
+
+def write_balance_snapshot(db: Session, as_of: datetime) -> int:
+    """
+    Closes the books at `as_of` by storing every account's balance at that moment.
+    Returns the number of accounts snapshotted. The caller commits.
+    """
+    rows = [
+        {"account_id": row.account_id, "as_of": as_of, "balance": row.balance, "created_at": datetime.utcnow()}
+        for row in db.execute(balances_as_of(as_of))
+    ]
+    if rows:
+        db.execute(insert(AccountBalanceSnapshot), rows)
+    return len(rows)
+
+
+def close_due_period(engine, grace_days: int, now: datetime | None = None) -> datetime | None:
+    """
+    Closes the books at the end of the most recent month that ended more than
+    `grace_days` ago, unless they are closed through it already, so late entries for a
+    month can still be posted during the grace period. Returns the closing moment, or
+    None if nothing was due. Safe to call from every worker.
+    """
+    moment = (now or datetime.utcnow()) - timedelta(days=grace_days)
+    due = datetime(moment.year, moment.month, 1)
+    with Session(engine) as db:
+        closed_at = db.scalar(select(latest_snapshot_at()))
+        if closed_at is not None and closed_at >= due:
+            return None
+        # Check again under the lock: another worker may have closed it meanwhile.
+        closed_at = closed_through(db, exclusive=True)
+        if closed_at is not None and closed_at >= due:
+            return None
+        write_balance_snapshot(db, due)
+        db.commit()
+    return due
+
+
+def _ledger_totals(conn, account_ids=None, after_line_id: int = 0, through_line_id: int | None = None) -> dict:
+    """Per-account sum of the lines with after_line_id < id <= through_line_id, in one grouped query."""
+    stmt = (
+        select(JournalEntryLine.account_id, func.sum(signed_line_amount()))
+        .join(Account, JournalEntryLine.account_id == Account.id)
+        .where(JournalEntryLine.id > after_line_id)
+        .group_by(JournalEntryLine.account_id)
+    )
+    if through_line_id is not None:
+        stmt = stmt.where(JournalEntryLine.id <= through_line_id)
+    if account_ids is not None:
+        stmt = stmt.where(JournalEntryLine.account_id.in_(account_ids))
+    return dict(conn.execute(stmt).all())
+
+
+def reconcile_ledger(engine) -> dict | None:
+    """
+    One reconciliation run: totals every account's journal lines, stores the totals with
+    the running balances as LedgerReconciliation rows, and returns the run's summary.
+
+    Runs are incremental. Each one starts from the previous run's totals and sums only
+    the lines added since its `last_line_id`, so the cost follows daily volume rather
+    than total history. An account whose drift is new or has changed since the previous
+    run is recounted from all of its lines before being reported, which also repairs
+    totals that missed a line committed out of id order. A drift that is unchanged was
+    confirmed by an earlier recount, so its total is carried forward instead.
+
+    Safe to call from every worker; returns None if another worker holds the lock.
+    """
+    postgres = engine.dialect.name == "postgresql"
+    # One snapshot for the whole run, so balances and lines are read at the same moment.
+    options = {"isolation_level": "REPEATABLE READ"} if postgres else {}
+    with engine.connect().execution_options(**options) as conn, conn.begin():
+        if postgres and not conn.execute(
+            text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _RECONCILIATION_LOCK_KEY}
+        ).scalar():
+            return None
+
+        previous = conn.execute(
+            select(LedgerReconciliation.reconciled_at, LedgerReconciliation.last_line_id)
+            .order_by(LedgerReconciliation.reconciled_at.desc())
+            .limit(1)
+        ).first()
+        after_line_id = previous.last_line_id if previous else 0
+        last_line_id = conn.scalar(select(func.coalesce(func.max(JournalEntryLine.id), 0)))
+
+        totals, previous_drift = {}, {}
+        if previous:
+            for account_id, ledger_balance, drift in conn.execute(
+                select(LedgerReconciliation.account_id, LedgerReconciliation.ledger_balance, LedgerReconciliation.drift)
+                .where(LedgerReconciliation.reconciled_at == previous.reconciled_at)
+            ):
+                totals[account_id] = ledger_balance
+                previous_drift[account_id] = drift
+        for account_id, amount in _ledger_totals(conn, None, after_line_id, last_line_id).items():
+            totals[account_id] = totals.get(account_id, 0) + amount
+
+        accounts = conn.execute(select(Account.id, Account.name, Account.balance)).all()
+        suspects = [
+            a.id for a in accounts
+            if a.balance != totals.get(a.id, 0) and a.balance - totals.get(a.id, 0) != previous_drift.get(a.id)
+        ]
+        if suspects and previous:
+            recounted = _ledger_totals(conn, suspects, 0, last_line_id)
+            for account_id in suspects:
+                totals[account_id] = recounted.get(account_id, 0)
+
+        reconciled_at = datetime.utcnow()
+        rows = [
+            {
+                "account_id": a.id,
+                "reconciled_at": reconciled_at,
+                "last_line_id": last_line_id,
+                "ledger_balance": totals.get(a.id, 0),
+                "account_balance": a.balance,
+                "drift": a.balance - totals.get(a.id, 0),
+            }
+            for a in accounts
+        ]
+        if rows:
+            conn.execute(insert(LedgerReconciliation), rows)
+        conn.execute(
+            delete(LedgerReconciliation).where(
+                LedgerReconciliation.reconciled_at < reconciled_at - timedelta(days=LEDGER_RECONCILIATION_RETENTION_DAYS)
+            )
+        )
+
+    names = {a.id: a.name for a in accounts}
+    return {
+        "reconciled_at": reconciled_at,
+        "last_line_id": last_line_id,
+        "accounts": len(rows),
+        "drift": [
+            {**row, "account_name": names[row["account_id"]]}
+            for row in rows if row["drift"] != 0
+        ],
+    }
+
+
+def latest_reconciliation(db: Session) -> dict | None:
+    """The summary of the most recent reconciliation run, in the shape reconcile_ledger returns."""
+    reconciled_at = db.scalar(select(func.max(LedgerReconciliation.reconciled_at)))
+    if reconciled_at is None:
+        return None
+    rows = db.execute(
+        select(LedgerReconciliation, Account.name)
+        .join(Account, LedgerReconciliation.account_id == Account.id)
+        .where(LedgerReconciliation.reconciled_at == reconciled_at)
+    ).all()
+    return {
+        "reconciled_at": reconciled_at,
+        "last_line_id": rows[0][0].last_line_id,
+        "accounts": len(rows),
+        "drift": [
+            {
+                "account_id": row.account_id,
+                "account_name": name,
+                "ledger_balance": row.ledger_balance,
+                "account_balance": row.account_balance,
+                "drift": row.drift,
+            }
+            for row, name in rows if row.drift != 0
+        ],
+    }
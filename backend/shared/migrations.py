@@ -0,0 +1,99 @@
+"""
+In-place upgrades for databases created before later columns and indexes existed.
+
+`create_all` only creates missing tables, so the auth service runs `upgrade_schema`
+right after it. Every step checks the live schema first, so running it again, or from
+several workers at once, is harmless.
+"""
+from sqlalchemy import Float, Numeric, inspect, text
+from sqlalchemy.orm import Session
+
+from shared.models import Base
+from shared.rollups import rebuild_rollups
+
+# Arbitrary key so that only one worker at a time upgrades the schema.
+_UPGRADE_LOCK_KEY = 7_310_005
+
+# Columns added to tables that already existed, in the order they are added.
+ADDED_COLUMNS = [
+    ("invoices", "created_date", "TIMESTAMP"),
+    ("invoices", "paid_date", "TIMESTAMP"),
+    ("bills", "created_date", "TIMESTAMP"),
+    ("bills", "project_id", "INTEGER REFERENCES projects (id)"),
+]
+
+# Run once, right after their column is added. Invoices and bills had no creation or
+# payment time, so the due date is the closest one available. Rows without a due date
+# stay NULL and are left out of the analytics time series.
+BACKFILLS = {
+    ("invoices", "created_date"): "UPDATE invoices SET created_date = due_date",
+    ("invoices", "paid_date"): "UPDATE invoices SET paid_date = created_date WHERE status = 'paid'",
+    ("bills", "created_date"): "UPDATE bills SET created_date = due_date",
+}
+
+
+def _numeric_columns():
+    """The fixed-point columns declared on the models, e.g. Money, as (table, column, type)."""
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if isinstance(column.type, Numeric) and not isinstance(column.type, Float):
+                yield table.name, column.name, column.type
+
+
+def _same_numeric(reflected, declared) -> bool:
+    return (
+        isinstance(reflected, Numeric)
+        and not isinstance(reflected, Float)
+        and (reflected.precision, reflected.scale) == (declared.precision, declared.scale)
+    )
+
+
+def upgrade_schema(engine) -> list[str]:
+    """
+    Adds and backfills the missing columns of ADDED_COLUMNS, converts money and quantity
+    columns still stored as floats to their declared numeric type, creates any missing
+    index declared on the models, and rebuilds the analytics rollups when a column was
+    added. Returns the columns added or converted, as "table.column".
+    """
+    added = []
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _UPGRADE_LOCK_KEY})
+        inspector = inspect(conn)
+        existing = {}
+        for table, column, ddl in ADDED_COLUMNS:
+            if table not in existing:
+                existing[table] = {c["name"] for c in inspector.get_columns(table)}
+            if column in existing[table]:
+                continue
+            conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {ddl}'))
+            if (table, column) in BACKFILLS:
+                conn.execute(text(BACKFILLS[(table, column)]))
+            added.append(f"{table}.{column}")
+
+        # Money used to be Float. SQLite only has type affinities, so its float values are
+        # read back through the Numeric type as they are; Postgres rewrites the column.
+        converted = []
+        if conn.dialect.name == "postgresql":
+            reflected = {}
+            for table, column, declared in _numeric_columns():
+                if table not in reflected:
+                    reflected[table] = {c["name"]: c["type"] for c in inspector.get_columns(table)}
+                if _same_numeric(reflected[table][column], declared):
+                    continue
+                ddl = f"NUMERIC({declared.precision}, {declared.scale})"
+                conn.execute(text(
+                    f'ALTER TABLE "{table}" ALTER COLUMN "{column}" TYPE {ddl} USING "{column}"::{ddl}'
+                ))
+                converted.append(f"{table}.{column}")
+
+        # Indexes added to existing tables are not created by create_all either.
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+    if added:
+        with Session(engine) as db:
+            rebuild_rollups(db)
+            db.commit()
+    return added + converted
@@ -1,3 +1,4 @@
+import os
 from sqlalchemy import (
     Column,
     Integer,
@@ -6,12 +7,35 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     Text,
+    Index,
+    Numeric,
 )
 from sqlalchemy.orm import declarative_base, relationship
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Annotated
+from pydantic import AfterValidator, condecimal
 
 Base = declarative_base()
 
+# Money is stored as exact fixed-point decimals, so sums and balances computed in the
+# database are exact. Values are read back as decimal.Decimal.
+Money = Numeric(14, 2)
+# Request schemas type money and quantities with these, so a value the column cannot hold
+# exactly (a third decimal place, or too many digits) is rejected with a 422 instead of
+# being rounded or overflowing in the database.
+MoneyAmount = condecimal(max_digits=14, decimal_places=2)
+QuantityAmount = condecimal(max_digits=14, decimal_places=3)
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+# Timestamps are stored as naive UTC. Request fields compared against stored ones use
+# this, so an offset in the input ("...+02:00") is converted instead of failing the comparison.
+UtcDateTime = Annotated[datetime, AfterValidator(to_naive_utc)]
+
 class User(Base):
     __tablename__ = 'users'
     id = Column(Integer, primary_key=True)
@@ -22,13 +46,19 @@ class User(Base):
 
     tasks = relationship("Task", back_populates="assignee")
 
+class RevokedToken(Base):
+    """A revoked refresh token id or family, kept until the tokens it revokes expire (see shared/revocation.py)."""
+    __tablename__ = 'revoked_tokens'
+    key = Column(String(64), primary_key=True) # 'jti:<id>' or 'fam:<id>'
+    expires_at = Column(DateTime, nullable=False, index=True)
+
 class Project(Base):
     __tablename__ = 'projects'
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False)
     description = Column(Text)
-    budget = Column(Float, nullable=False)
-    actual_cost = Column(Float, default=0.0)
+    budget = Column(Money, nullable=False)
+    actual_cost = Column(Money, default=0)
     start_date = Column(DateTime, default=datetime.utcnow)
     end_date = Column(DateTime)
     percentage_complete = Column(Float, default=0.0)
@@ -38,6 +68,11 @@ class Project(Base):
     tasks = relationship("Task", back_populates="project")
     invoices = relationship("Invoice", back_populates="project")
 
+    # Project lists page newest-first by id, often for one manager.
+    __table_args__ = (
+        Index('ix_projects_manager_id_id', 'manager_id', 'id'),
+    )
+
 class Task(Base):
     __tablename__ = 'tasks'
     id = Column(Integer, primary_key=True)
@@ -52,9 +87,11 @@ class Task(Base):
 class Invoice(Base):
     __tablename__ = 'invoices'
     id = Column(Integer, primary_key=True)
-    amount = Column(Float, nullable=False)
+    amount = Column(Money, nullable=False)
     status = Column(String(50), default='pending') # e.g., pending, paid, overdue
     due_date = Column(DateTime)
+    created_date = Column(DateTime, default=datetime.utcnow)
+    paid_date = Column(DateTime) # Set while the status is 'paid'
     project_id = Column(Integer, ForeignKey('projects.id'), nullable=False)
 
     project = relationship('Project', back_populates="invoices")
@@ -70,7 +107,7 @@ class Employee(Base):
     phone_number = Column(String(50))
     address = Column(Text)
     hire_date = Column(DateTime, default=datetime.utcnow)
-    salary = Column(Float)
+    salary = Column(Money)
     emergency_contact_name = Column(String(100))
     emergency_contact_phone = Column(String(50))
 
@@ -98,7 +135,7 @@ class Quotation(Base):
     id = Column(Integer, primary_key=True)
     client_name = Column(String(100), nullable=False)
     status = Column(String(50), default='draft') # e.g., draft, sent, accepted, rejected
-    total_amount = Column(Float, nullable=False)
+    total_amount = Column(Money, nullable=False)
     created_date = Column(DateTime, default=datetime.utcnow)
     project_id = Column(Integer, ForeignKey('projects.id'))
     created_by_id = Column(Integer, ForeignKey('users.id'))
@@ -107,13 +144,18 @@ class Quotation(Base):
     created_by = relationship('User')
     items = relationship('QuotationItem', back_populates='quotation', cascade="all, delete-orphan")
 
+    # Quote lists page newest-first by id, often within one status.
+    __table_args__ = (
+        Index('ix_quotations_status_id', 'status', 'id'),
+    )
+
 class QuotationItem(Base):
     __tablename__ = 'quotation_items'
     id = Column(Integer, primary_key=True)
-    quotation_id = Column(Integer, ForeignKey('quotations.id'), nullable=False)
+    quotation_id = Column(Integer, ForeignKey('quotations.id'), nullable=False, index=True)
     description = Column(Text, nullable=False)
-    quantity = Column(Float, nullable=False)
-    unit_price = Column(Float, nullable=False)
+    quantity = Column(Numeric(14, 3), nullable=False)
+    unit_price = Column(Money, nullable=False)
 
     quotation = relationship('Quotation', back_populates='items')
 
@@ -122,16 +164,29 @@ Project.quotations = relationship("Quotation", back_populates="project")
 
 
 # --- Activity Log Model ---
+# With ACTIVITY_LOG_PARTITIONING=monthly the table is created as a Postgres table
+# range-partitioned on timestamp (see shared/partitions.py for partition upkeep).
+# Postgres requires the partition key in the primary key, hence the composite key.
+ACTIVITY_LOG_PARTITIONED = os.getenv("ACTIVITY_LOG_PARTITIONING", "").lower() == "monthly"
+
 class ActivityLog(Base):
     __tablename__ = 'activity_logs'
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     action = Column(String(100), nullable=False)
     details = Column(Text) # Can store JSON as string
-    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False, primary_key=ACTIVITY_LOG_PARTITIONED)
 
     user = relationship('User')
 
+    # Keyset pagination walks (timestamp, id) newest-first, optionally within one user or action.
+    __table_args__ = (
+        Index('ix_activity_logs_timestamp_id', 'timestamp', 'id'),
+        Index('ix_activity_logs_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        Index('ix_activity_logs_action_timestamp_id', 'action', 'timestamp', 'id'),
+        {'postgresql_partition_by': 'RANGE ("timestamp")'} if ACTIVITY_LOG_PARTITIONED else {},
+    )
+
 
 # --- Core Accounting Models ---
 class Account(Base):
@@ -141,7 +196,7 @@ class Account(Base):
     name = Column(String(100), unique=True, nullable=False)
     type = Column(String(50), nullable=False) # Asset, Liability, Equity, Revenue, Expense
     normal_balance = Column(String(10), nullable=False) # 'debit' or 'credit'
-    balance = Column(Float, default=0.0, nullable=False)
+    balance = Column(Money, default=0, nullable=False)
 
     journal_lines = relationship('JournalEntryLine', back_populates='account')
 
@@ -154,6 +209,11 @@ class JournalEntry(Base):
 
     lines = relationship('JournalEntryLine', back_populates='entry', cascade="all, delete-orphan")
 
+    # Point-in-time reports select entries by date, then their lines by entry_id.
+    __table_args__ = (
+        Index('ix_journal_entries_date_id', 'date', 'id'),
+    )
+
 class JournalEntryLine(Base):
     """Represents a single line (a debit or credit) within a Journal Entry."""
     __tablename__ = 'journal_entry_lines'
@@ -161,11 +221,53 @@ class JournalEntryLine(Base):
     entry_id = Column(Integer, ForeignKey('journal_entries.id'), nullable=False)
     account_id = Column(Integer, ForeignKey('accounts.id'), nullable=False)
     type = Column(String(10), nullable=False) # 'debit' or 'credit'
-    amount = Column(Float, nullable=False)
+    amount = Column(Money, nullable=False)
 
     entry = relationship('JournalEntry', back_populates='lines')
     account = relationship('Account', back_populates='journal_lines')
 
+    __table_args__ = (
+        Index('ix_journal_entry_lines_entry_id_account_id', 'entry_id', 'account_id'),
+    )
+
+class AccountBalanceSnapshot(Base):
+    """
+    An account's balance at the start of `as_of`, written when a period is closed.
+    Point-in-time reports start from the latest snapshot and add only the lines after it.
+    """
+    __tablename__ = 'account_balance_snapshots'
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('accounts.id'), nullable=False)
+    as_of = Column(DateTime, nullable=False)
+    balance = Column(Money, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    account = relationship('Account')
+
+    __table_args__ = (
+        Index('ix_account_balance_snapshots_as_of_account_id', 'as_of', 'account_id', unique=True),
+    )
+
+class LedgerReconciliation(Base):
+    """
+    One account's total from its journal lines up to `last_line_id`, compared with its
+    running Account.balance. Written for every account by each reconciliation run.
+    """
+    __tablename__ = 'ledger_reconciliations'
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('accounts.id'), nullable=False)
+    reconciled_at = Column(DateTime, nullable=False)
+    last_line_id = Column(Integer, nullable=False)
+    ledger_balance = Column(Money, nullable=False)
+    account_balance = Column(Money, nullable=False)
+    drift = Column(Money, nullable=False) # account_balance - ledger_balance
+
+    account = relationship('Account')
+
+    __table_args__ = (
+        Index('ix_ledger_reconciliations_reconciled_at_account_id', 'reconciled_at', 'account_id'),
+    )
+
 
 # --- Accounts Payable Models ---
 class Vendor(Base):
@@ -184,9 +286,32 @@ class Bill(Base):
     __tablename__ = 'bills'
     id = Column(Integer, primary_key=True)
     vendor_id = Column(Integer, ForeignKey('vendors.id'), nullable=False)
-    amount = Column(Float, nullable=False)
+    amount = Column(Money, nullable=False)
     due_date = Column(DateTime)
     paid_date = Column(DateTime)
     status = Column(String(50), default='unpaid') # unpaid, paid
+    created_date = Column(DateTime, default=datetime.utcnow)
+    project_id = Column(Integer, ForeignKey('projects.id')) # The project the cost is charged to, if any
 
     vendor = relationship('Vendor', back_populates='bills')
+
+
+# --- Analytics Models ---
+class AnalyticsRollup(Base):
+    """
+    A pre-aggregated metric (e.g. the amount invoiced) for one project and one week or
+    month. Kept current by the write paths in the same transaction (see shared/rollups.py).
+    project_id 0 collects amounts that belong to no project.
+    """
+    __tablename__ = 'analytics_rollups'
+    id = Column(Integer, primary_key=True)
+    metric = Column(String(20), nullable=False) # invoiced, paid, billed, quoted
+    granularity = Column(String(10), nullable=False) # week, month
+    period_start = Column(DateTime, nullable=False)
+    project_id = Column(Integer, nullable=False, default=0)
+    amount = Column(Money, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_analytics_rollups_series', 'metric', 'granularity', 'project_id', 'period_start', unique=True),
+    )
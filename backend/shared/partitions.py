@@ -0,0 +1,185 @@
+"""
+Upkeep for the monthly range partitions of the activity log.
+
+When ACTIVITY_LOG_PARTITIONING=monthly, `activity_logs` is a partitioned Postgres table.
+Each month lives in its own `activity_logs_YYYY_MM` partition, and a DEFAULT partition
+catches anything outside them. New months are created ahead of time, so inserts always
+land in a small, recent partition. Whole partitions past the retention window are
+detached and dropped, optionally archived first to gzipped CSV, instead of being
+deleted row by row.
+"""
+import gzip
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from shared.models import ActivityLog, ACTIVITY_LOG_PARTITIONED
+
+ACTIVITY_LOG_PARTITIONS_AHEAD = int(os.getenv("ACTIVITY_LOG_PARTITIONS_AHEAD", "3"))
+# Unset keeps history forever.
+ACTIVITY_LOG_RETENTION_MONTHS = os.getenv("ACTIVITY_LOG_RETENTION_MONTHS")
+# When set, expired partitions are written here as <partition>.csv.gz before being dropped.
+ACTIVITY_LOG_ARCHIVE_DIR = os.getenv("ACTIVITY_LOG_ARCHIVE_DIR")
+
+# Arbitrary key so that only one worker at a time runs maintenance.
+_MAINTENANCE_LOCK_KEY = 7_310_001
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+# Tables are looked up through to_regclass, so only the one on the search_path counts,
+# not a same-named table in another schema.
+def is_partitioned(conn, table: str) -> bool:
+    return conn.execute(
+        text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(quote_ident(:table))"),
+        {"table": table},
+    ).first() is not None
+
+def monthly_partitions(conn, table: str) -> dict[datetime, str]:
+    """Maps the first day of each month to the name of its partition."""
+    rows = conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits i "
+            "JOIN pg_class child ON child.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(quote_ident(:table))"
+        ),
+        {"table": table},
+    ).scalars()
+    pattern = re.compile(rf"^{re.escape(table)}_(\d{{4}})_(\d{{2}})$")
+    partitions = {}
+    for name in rows:
+        match = pattern.match(name)
+        if match:
+            partitions[datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def create_monthly_partition(conn, table: str, start: datetime):
+    """
+    Creates the partition for the month starting at `start`. Rows of that month already
+    in the DEFAULT partition would make the new bounds overlap it, so DEFAULT is detached
+    while they are moved into the new partition, then attached again.
+    """
+    end = add_months(start, 1)
+    name = partition_name(table, start)
+    default = f"{table}_default"
+    bounds = f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    in_month = f"\"timestamp\" >= '{start:%Y-%m-%d}' AND \"timestamp\" < '{end:%Y-%m-%d}'"
+    if conn.execute(text(f'SELECT 1 FROM "{default}" WHERE {in_month} LIMIT 1')).first() is None:
+        conn.execute(text(f'CREATE TABLE "{name}" PARTITION OF "{table}" {bounds}'))
+        return
+    conn.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"'))
+    conn.execute(text(f'CREATE TABLE "{name}" PARTITION OF "{table}" {bounds}'))
+    conn.execute(text(f'INSERT INTO "{name}" SELECT * FROM "{default}" WHERE {in_month}'))
+    conn.execute(text(f'DELETE FROM "{default}" WHERE {in_month}'))
+    conn.execute(text(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT'))
+
+
+def ensure_monthly_partitions(conn, table: str, months_ahead: int, now: datetime | None = None) -> list[str]:
+    """
+    Creates the DEFAULT partition and any missing partition per month from now until
+    `months_ahead`. Each month gets its own savepoint, so one failure neither stops the
+    other months nor the retention run that follows. Returns the partitions created.
+    """
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{table}_default" PARTITION OF "{table}" DEFAULT'))
+    existing = monthly_partitions(conn, table)
+    current = month_start(now or datetime.utcnow())
+    created = []
+    for offset in range(months_ahead + 1):
+        start = add_months(current, offset)
+        if start in existing:
+            continue
+        try:
+            with conn.begin_nested():
+                create_monthly_partition(conn, table, start)
+        except SQLAlchemyError as exc:
+            print(f"Could not create partition {partition_name(table, start)}: {exc}")
+            continue
+        created.append(partition_name(table, start))
+    return created
+
+
+def _archive(conn, query: str, path: str):
+    """
+    Streams the result of `query` into a new gzipped CSV file with Postgres COPY.
+    Raises FileExistsError rather than overwrite an earlier archive.
+    """
+    raw = conn.connection.dbapi_connection
+    with gzip.open(path, "xb") as archive, raw.cursor() as cursor:
+        cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", archive)
+
+
+def expire_partitions(conn, table: str, keep_months: int, archive_dir: str | None = None, now: datetime | None = None) -> list[str]:
+    """
+    Detaches and drops the monthly partitions older than `keep_months` full months,
+    archiving each first when `archive_dir` is given, each in its own savepoint.
+    Returns the expired partition names.
+    """
+    cutoff = add_months(month_start(now or datetime.utcnow()), -keep_months)
+    expired = []
+    for month, name in sorted(monthly_partitions(conn, table).items()):
+        if month >= cutoff:
+            break
+        try:
+            with conn.begin_nested():
+                conn.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+                if archive_dir:
+                    _archive(conn, f'SELECT * FROM "{name}"', os.path.join(archive_dir, f"{name}.csv.gz"))
+                conn.execute(text(f'DROP TABLE "{name}"'))
+        except Exception as exc: # also DBAPI errors from the raw COPY and file errors
+            print(f"Could not expire partition {name}: {exc}")
+            continue
+        expired.append(name)
+
+    # Rows that fell into the DEFAULT partition are expired row by row. Later passes can
+    # find more such rows for the same cutoff, so each pass writes its own archive.
+    default = f"{table}_default"
+    cutoff_literal = f"'{cutoff:%Y-%m-%d}'"
+    run = datetime.utcnow()
+    try:
+        with conn.begin_nested():
+            if conn.execute(text(f'SELECT 1 FROM "{default}" WHERE "timestamp" < {cutoff_literal} LIMIT 1')).first():
+                if archive_dir:
+                    _archive(
+                        conn,
+                        f'SELECT * FROM "{default}" WHERE "timestamp" < {cutoff_literal}',
+                        os.path.join(archive_dir, f"{default}_before_{cutoff:%Y_%m}_{run:%Y%m%dT%H%M%S}.csv.gz"),
+                    )
+                conn.execute(text(f'DELETE FROM "{default}" WHERE "timestamp" < {cutoff_literal}'))
+    except Exception as exc: # also DBAPI errors from the raw COPY and file errors
+        print(f"Could not expire rows of {default}: {exc}")
+    return expired
+
+
+def maintain_activity_log_partitions(engine) -> list[str]:
+    """
+    One maintenance pass: create upcoming partitions, then apply the retention policy.
+    Safe to call from every worker; only the one holding the advisory lock does the work.
+    """
+    if not ACTIVITY_LOG_PARTITIONED:
+        return []
+    table = ActivityLog.__tablename__
+    with engine.begin() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _MAINTENANCE_LOCK_KEY}).scalar():
+            return []
+        if not is_partitioned(conn, table):
+            print(f"'{table}' is not a partitioned table; skipping partition maintenance.")
+            return []
+        ensure_monthly_partitions(conn, table, ACTIVITY_LOG_PARTITIONS_AHEAD)
+        if ACTIVITY_LOG_RETENTION_MONTHS is None:
+            return []
+        if ACTIVITY_LOG_ARCHIVE_DIR:
+            os.makedirs(ACTIVITY_LOG_ARCHIVE_DIR, exist_ok=True)
+        return expire_partitions(conn, table, int(ACTIVITY_LOG_RETENTION_MONTHS), ACTIVITY_LOG_ARCHIVE_DIR)
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from shared.models import RevokedToken
+
+# Where revoked refresh tokens are remembered. The default, "database", is the
+# revoked_tokens table, shared by every worker and host. "sqlite:///path/to/file.db"
+# uses a local file shared by the workers on one host. "memory" keeps them in process
+# memory and is refused when WEB_CONCURRENCY asks for more than one worker, since a
+# token reused on another worker would go unnoticed.
+REFRESH_TOKEN_STORE = os.getenv("REFRESH_TOKEN_STORE", "database")
+
+
+class MemoryRevocationStore:
+    """
+    Revoked keys with the time they can be forgotten. Only revocations are stored, and
+    each one expires with the token it revokes, so the store stays small.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}
+
+    def revoke(self, key: str, expires_at: float) -> bool:
+        """Revokes `key` and returns True, or returns False if it was already revoked."""
+        now = time.time()
+        with self._lock:
+            if self._revoked.get(key, 0) > now:
+                return False
+            self._revoked[key] = expires_at
+            if len(self._revoked) > 10000:
+                self._revoked = {k: exp for k, exp in self._revoked.items() if exp > now}
+            return True
+
+    def is_revoked(self, key: str) -> bool:
+        with self._lock:
+            return self._revoked.get(key, 0) > time.time()
+
+
+class SqliteRevocationStore:
+    """The same contract as MemoryRevocationStore, backed by a local SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS revoked (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def revoke(self, key: str, expires_at: float) -> bool:
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM revoked WHERE expires_at <= ?", (now,))
+            cursor = conn.execute("INSERT OR IGNORE INTO revoked (key, expires_at) VALUES (?, ?)", (key, expires_at))
+            return cursor.rowcount == 1
+
+    def is_revoked(self, key: str) -> bool:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT 1 FROM revoked WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return row is not None
+
+
+class DatabaseRevocationStore:
+    """The same contract as MemoryRevocationStore, backed by the revoked_tokens table."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def revoke(self, key: str, expires_at: float) -> bool:
+        now = datetime.utcnow()
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+                conn.execute(insert(RevokedToken).values(key=key, expires_at=datetime.utcfromtimestamp(expires_at)))
+        except IntegrityError:
+            # The primary key makes concurrent revocations of one key race safely: one wins.
+            return False
+        return True
+
+    def is_revoked(self, key: str) -> bool:
+        with self.engine.connect() as conn:
+            return conn.scalar(
+                select(RevokedToken.key).where(RevokedToken.key == key, RevokedToken.expires_at > datetime.utcnow())
+            ) is not None
+
+
+def create_revocation_store(url: str = REFRESH_TOKEN_STORE, engine=None):
+    if url.startswith("sqlite:///"):
+        return SqliteRevocationStore(url[len("sqlite:///"):])
+    if url == "memory":
+        if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+            raise RuntimeError("REFRESH_TOKEN_STORE=memory cannot detect token reuse across workers; use 'database'.")
+        return MemoryRevocationStore()
+    if engine is None:
+        from shared.database import engine
+    return DatabaseRevocationStore(engine)
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import String, delete, func, insert, literal, literal_column, select, text, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from shared.models import AnalyticsRollup, Bill, Invoice, Quotation
+
+# Metrics and the date each one is bucketed by:
+#   invoiced - Invoice.amount by created_date (revenue, on an accrual basis)
+#   paid     - Invoice.amount by paid_date
+#   billed   - Bill.amount by created_date (cost)
+#   quoted   - Quotation.total_amount by created_date
+ROLLUP_METRICS = ("invoiced", "paid", "billed", "quoted")
+ROLLUP_GRANULARITIES = ("week", "month")
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# Writers hold this advisory lock shared and a rebuild holds it exclusively (see _lock_rollups).
+_ROLLUP_LOCK_KEY = 7_310_004
+
+
+def period_start(when: datetime, granularity: str) -> datetime:
+    """The start of the ISO week (Monday) or calendar month containing `when`."""
+    day = datetime(when.year, when.month, when.day)
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _lock_rollups(db: Session, exclusive: bool = False):
+    """
+    Takes the rollup lock until the transaction ends. record_rollup takes it shared, so
+    writers never wait on each other, and rebuild_rollups exclusively: a rebuild waits for
+    the writers in flight and counts their rows, and later increments land on top of the
+    rebuilt totals instead of being wiped by them. A no-op outside Postgres.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        lock = "pg_advisory_xact_lock" if exclusive else "pg_advisory_xact_lock_shared"
+        db.execute(text(f"SELECT {lock}(:key)"), {"key": _ROLLUP_LOCK_KEY})
+
+
+def _upsert(db: Session, rows: list):
+    """Adds each row's amount and count to its rollup, creating the rollup if needed."""
+    upsert = _UPSERT_DIALECTS[db.get_bind().dialect.name]
+    stmt = upsert(AnalyticsRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["metric", "granularity", "project_id", "period_start"],
+        set_={
+            "amount": AnalyticsRollup.amount + stmt.excluded.amount,
+            "count": AnalyticsRollup.count + stmt.excluded.count,
+        },
+    )
+    # A fixed order, so concurrent writers take the rollup row locks in the same order.
+    rows.sort(key=lambda row: (row["metric"], row["granularity"], row["project_id"], row["period_start"]))
+    db.execute(stmt, rows)
+
+
+def record_rollup(db: Session, metric: str, project_id: int | None, when: datetime, amount, count: int = 1):
+    """
+    Adds `amount` to the weekly and monthly rollups of `metric` containing `when`.
+    Call it from the write path, inside the transaction that makes the change, and
+    with a negative amount and count to take a change back.
+    """
+    _lock_rollups(db)
+    _upsert(db, [
+        {
+            "metric": metric,
+            "granularity": granularity,
+            "period_start": period_start(when, granularity),
+            "project_id": project_id or 0,
+            "amount": amount,
+            "count": count,
+        }
+        for granularity in ROLLUP_GRANULARITIES
+    ])
+
+
+def _rollup_sources():
+    return {
+        "invoiced": (Invoice.project_id, Invoice.created_date, Invoice.amount),
+        "paid": (Invoice.project_id, Invoice.paid_date, Invoice.amount),
+        "billed": (Bill.project_id, Bill.created_date, Bill.amount),
+        "quoted": (Quotation.project_id, Quotation.created_date, Quotation.total_amount),
+    }
+
+
+def _period_start_sql(when, granularity: str, dialect: str):
+    """SQL counterpart of period_start."""
+    if dialect == "postgresql":
+        return func.date_trunc(literal_column(f"'{granularity}'"), when)
+    # SQLite: the same text format SQLAlchemy stores DateTime values in, so rebuilt rows
+    # and rows upserted by record_rollup collide on the unique series index.
+    if granularity == "week":
+        day = func.date(when, "weekday 0", "-6 days")
+    else:
+        day = func.date(when, "start of month")
+    return day + literal(" 00:00:00.000000", String)
+
+
+def rebuild_rollups(db: Session) -> int:
+    """
+    Recomputes every rollup from the source tables, e.g. to backfill existing data, in
+    one INSERT ... SELECT ... GROUP BY, under the exclusive rollup lock (see _lock_rollups).
+    Returns the number of rollups written. The caller commits.
+    """
+    _lock_rollups(db, exclusive=True)
+    dialect = db.get_bind().dialect.name
+    selects = []
+    for metric, (project_id, when, amount) in _rollup_sources().items():
+        for granularity in ROLLUP_GRANULARITIES:
+            start = _period_start_sql(when, granularity, dialect)
+            project = func.coalesce(project_id, 0)
+            selects.append(
+                select(
+                    literal(metric, String).label("metric"),
+                    literal(granularity, String).label("granularity"),
+                    project.label("project_id"),
+                    start.label("period_start"),
+                    func.sum(amount).label("amount"),
+                    func.count().label("count"),
+                )
+                .where(when.is_not(None))
+                .group_by(project, start)
+            )
+
+    db.execute(delete(AnalyticsRollup))
+    columns = ["metric", "granularity", "project_id", "period_start", "amount", "count"]
+    return db.execute(insert(AnalyticsRollup).from_select(columns, union_all(*selects))).rowcount
@@ -1,14 +1,28 @@
+import hashlib
 import os
-from fastapi import Depends, HTTPException, status
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from shared.database import get_db
+from shared.models import User
 
 # This is the central configuration for JWTs.
 # It should be consistent across all services that use it.
 SECRET_KEY = os.getenv("SECRET_KEY", "a-very-secret-key-that-is-not-secure")
 ALGORITHM = "HS256"
 
+# Verified tokens are cached so repeat requests from a session skip the signature check.
+# Entries never outlive the token's own `exp`.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+
 # The tokenUrl should point to the login endpoint of the auth service.
 # This is used for generating OpenAPI documentation.
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
@@ -16,27 +30,131 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 class TokenPayload(BaseModel):
     sub: str | None = None
     role: str | None = None
+    uid: int | None = None # The user's id; absent from tokens issued before it was added
+    exp: int | None = None
 
-def get_current_user_payload(token: str = Depends(oauth2_scheme)) -> TokenPayload:
-    """
-    Dependency to get the current user's payload from the JWT token.
+class CurrentUser(BaseModel):
+    """The authenticated user, built from the token's claims."""
+    id: int
+    username: str
+    role: str | None = None
+
+
+class _CachedToken:
+    __slots__ = ("payload", "expires_at", "user_id")
+
+    def __init__(self, payload: TokenPayload, expires_at: float):
+        self.payload = payload
+        self.expires_at = expires_at
+        self.user_id = None
+
+
+class TokenCache:
+    """A thread-safe LRU of verified tokens, keyed by a hash of the raw token."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, key: str) -> _CachedToken | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, payload: TokenPayload, exp: float | None) -> _CachedToken:
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        entry = _CachedToken(payload, expires_at)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
 
-    This function decodes the token, validates its signature and expiration,
-    and returns the payload. It raises an HTTP 401 Unauthorized error if
-    the token is invalid or missing.
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS)
+
+
+def verify_access_token(token: str) -> TokenPayload:
+    """
+    Decodes an access token, validating its signature and expiration, and returns
+    its payload. Tokens seen recently are served from `token_cache` without decoding
+    them again. Raises an HTTP 401 Unauthorized error if the token is invalid,
+    including when it is a refresh token.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    key = TokenCache.key(token)
+    entry = token_cache.get(key)
+    if entry is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None or payload.get("type") == "refresh":
+                raise credentials_exception
+            token_data = TokenPayload(**payload)
+        except JWTError:
             raise credentials_exception
-        token_data = TokenPayload(**payload)
-    except JWTError:
-        raise credentials_exception
+        entry = token_cache.put(key, token_data, payload.get("exp"))
+    return entry.payload
+
+def get_current_user_payload(request: Request, token: str = Depends(oauth2_scheme)) -> TokenPayload:
+    """
+    Dependency to get the current user's payload from the JWT token.
+
+    It raises an HTTP 401 Unauthorized error if the token is invalid or missing
+    (see verify_access_token).
+    """
+    payload = verify_access_token(token)
+    request.state.token_key = TokenCache.key(token)
+    return payload
+
+def require_admin(payload: TokenPayload = Depends(get_current_user_payload)) -> TokenPayload:
+    """Dependency that only lets admins through, for operational endpoints such as /pool-stats."""
+    if payload.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only admins can access this endpoint.")
+    return payload
 
-    return token_data
+def get_current_user(
+    request: Request,
+    payload: TokenPayload = Depends(get_current_user_payload),
+    db: Session = Depends(get_db),
+) -> CurrentUser:
+    """
+    Dependency returning the current user without touching the users table.
+
+    The id comes from the token's `uid` claim. Tokens issued before that claim existed
+    fall back to a lookup by username, done once per token and cached with it.
+    """
+    user_id = payload.uid
+    if user_id is None:
+        entry = token_cache.get(request.state.token_key)
+        user_id = entry.user_id if entry is not None else None
+        if user_id is None:
+            user_id = db.query(User.id).filter(User.username == payload.sub).scalar()
+            if user_id is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
+            if entry is not None:
+                entry.user_id = user_id
+    return CurrentUser(id=user_id, username=payload.sub, role=payload.role)
@@ -1,8 +1,25 @@
 import { useEffect } from 'react';
 import { useTranslation } from 'react-i18next';
+import axios from 'axios';
 import '../i18n'; // Initialize i18next
 import '../styles/Home.module.css'; // Using module CSS as global is not standard, but follows project setup
 
+// Read-after-write consistency: services answer a write with an X-DB-Last-Write marker.
+// Sending the latest one back on every request keeps our reads on the primary database
+// until the read replica has caught up with our own changes, whichever service we ask.
+if (typeof window !== 'undefined') {
+  let lastWrite = null;
+  axios.interceptors.response.use((response) => {
+    const marker = response.headers['x-db-last-write'];
+    if (marker) lastWrite = marker;
+    return response;
+  });
+  axios.interceptors.request.use((config) => {
+    if (lastWrite) config.headers['X-DB-Last-Write'] = lastWrite;
+    return config;
+  });
+}
+
 function MyApp({ Component, pageProps }) {
   const { i18n } = useTranslation();
 
@@ -5,6 +5,7 @@ import { jwtDecode } from 'jwt-decode';
 import { useTranslation } from 'react-i18next';
 import styles from '../styles/Home.module.css';
 import Navbar from '../components/Navbar';
+import { fetchAllPages } from '../pagination';
 
 export default function AccountingPage() {
     const { t } = useTranslation();
@@ -59,10 +60,9 @@ export default function AccountingPage() {
 
     const fetchProjects = async (token) => {
         try {
-            const response = await axios.get(`${projectsApiUrl}/projects/`, {
+            setProjects(await fetchAllPages(`${projectsApiUrl}/projects/summary`, {
                 headers: { Authorization: `Bearer ${token}` },
-            });
-            setProjects(response.data);
+            }));
         } catch (error) {
             setMessage('Failed to fetch projects.');
         }
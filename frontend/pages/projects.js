@@ -4,6 +4,7 @@ import axios from 'axios';
 import { useTranslation } from 'react-i18next';
 import styles from '../styles/Home.module.css';
 import Navbar from '../components/Navbar';
+import { fetchAllPages } from '../pagination';
 
 export default function ProjectsPage() {
     const { t } = useTranslation();
@@ -47,10 +48,9 @@ export default function ProjectsPage() {
 
     const fetchProjects = async (token) => {
         try {
-            const response = await axios.get(`${projectsApiUrl}/projects/`, {
+            setProjects(await fetchAllPages(`${projectsApiUrl}/projects/summary`, {
                 headers: { Authorization: `Bearer ${token}` },
-            });
-            setProjects(response.data);
+            }));
         } catch (error) {
             setMessage('Failed to fetch projects.');
             // Handle token expiration, e.g., redirect to login
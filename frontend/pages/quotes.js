@@ -6,6 +6,7 @@ import jsPDF from 'jspdf';
 import { useTranslation } from 'react-i18next';
 import styles from '../styles/Home.module.css';
 import Navbar from '../components/Navbar';
+import { fetchAllPages } from '../pagination';
 
 export default function QuotesPage() {
     const { t } = useTranslation();
@@ -44,10 +45,9 @@ export default function QuotesPage() {
 
     const fetchQuotes = async (token) => {
         try {
-            const response = await axios.get(`${quotesApiUrl}/quotes/`, {
+            setQuotes(await fetchAllPages(`${quotesApiUrl}/quotes/`, {
                 headers: { Authorization: `Bearer ${token}` },
-            });
-            setQuotes(response.data);
+            }));
         } catch (error) {
             setMessage('Failed to fetch quotes.');
         }
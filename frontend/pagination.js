@@ -0,0 +1,18 @@
+import axios from 'axios';
+
+// List endpoints return one page at a time and set X-Next-Cursor while more remain.
+// Fetches every page of `url` and returns the concatenated rows, for views that
+// need the full list (e.g. a project picker).
+export async function fetchAllPages(url, config = {}, pageSize = 1000) {
+  const rows = [];
+  let cursor;
+  do {
+    const response = await axios.get(url, {
+      ...config,
+      params: { ...config.params, limit: pageSize, ...(cursor ? { cursor } : {}) },
+    });
+    rows.push(...response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return rows;
+}